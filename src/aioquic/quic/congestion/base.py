@@ -16,6 +16,8 @@ class QuicCongestionControl(abc.ABC):
     bytes_in_flight: int = 0
     congestion_window: int = 0
     ssthresh: Optional[int] = None
+    # explicit pacing rate in bytes per second, None derives it from the cwnd
+    pacing_rate: Optional[float] = None
 
     def __init__(self, *, max_datagram_size: int, is_client=False) -> None:
         self.congestion_window = K_INITIAL_WINDOW * max_datagram_size
@@ -37,6 +39,17 @@ class QuicCongestionControl(abc.ABC):
     @abc.abstractmethod
     def on_rtt_measurement(self, *, now: float, rtt: float) -> None: ...
 
+    def on_rate_sample(self, *, now: float, delivery_rate: float) -> None:
+        """
+        Handle a delivery rate sample, in bytes per second.
+        """
+
+    def close(self) -> None:
+        """
+        Release resources held by the congestion control once the connection
+        has terminated.
+        """
+
     def get_log_data(self) -> Dict[str, Any]:
         data = {"cwnd": self.congestion_window, "bytes_in_flight": self.bytes_in_flight}
         if self.ssthresh is not None:
@@ -1,4 +1,3 @@
-import asyncio
 from typing import Any, Dict, Iterable
 
 import TimestampLogger
@@ -47,66 +46,20 @@ class CubicCongestionControl(QuicCongestionControl):
         self.last_ack = 0.0
 
         # added for monitoring
-        self.acked_bytes_in_interval = 0
-        self.sent_bytes_in_interval = 0
-        self.lost_byte_in_interval = 0
-
-        self.acked_byte_raw = 0
-        self.sent_byte_raw = 0
-        self.lost_byte_raw = 0
-
         self.rtt_estimate = 1
-        self.sampling_interval = 1 / float(external_config["cca"]["sampling_rate"])
         self.logger = TimestampLogger.TimestampLogger(
-            ui_out=True, external_config=external_config, algo_instance=self
+            ui_out=external_config["out"].get("ui_out", True),
+            external_config=external_config,
+            algo_instance=self,
         )
 
         self.logger.register_metric("cwnd", lambda: self.congestion_window)
-        self.logger.register_metric(
-            "acked_byte",
-            lambda: self.acked_bytes_in_interval,
-            self.reset_acked_byte,
-        )
+        self.acked_byte = self.logger.register_counter("acked_byte")
         self.logger.register_metric("rtt", lambda: self.rtt_estimate)
-        self.logger.register_metric(
-            "sent_byte",
-            lambda: self.sent_bytes_in_interval,
-            cleanup_function=self.reset_sent_byte,
-        )
-        self.logger.register_metric(
-            "lost_byte",
-            lambda: self.lost_byte_in_interval,
-            cleanup_function=self.reset_lost_byte,
-        )
-
-        t = asyncio.create_task(self.logger.pass_timestamps())
-        t.add_done_callback(
-            lambda t: print("TASK FINISHED:", t, "EXCEPTION:", t.exception())
-        )
-
-    def get_acked_byte_raw(self):
-        temp = self.acked_byte_raw
-        self.acked_byte_raw = 0
-        return temp
-
-    def get_sent_byte_raw(self):
-        temp = self.sent_byte_raw
-        self.sent_byte_raw = 0
-        return temp
+        self.sent_byte = self.logger.register_counter("sent_byte")
+        self.lost_byte = self.logger.register_counter("lost_byte")
 
-    def get_lost_byte_raw(self):
-        temp = self.lost_byte_raw
-        self.lost_byte_raw = 0
-        return temp
-
-    def reset_acked_byte(self):
-        self.acked_bytes_in_interval = 0
-
-    def reset_sent_byte(self):
-        self.sent_bytes_in_interval = 0
-
-    def reset_lost_byte(self):
-        self.lost_byte_in_interval = 0
+        self.logger.start()
 
     def W_cubic(self, t) -> int:
         W_max_segments = self._W_max / self._max_datagram_size
@@ -136,10 +89,7 @@ class CubicCongestionControl(QuicCongestionControl):
         self.last_ack = packet.sent_time
 
         # added for monitoring
-        self.acked_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-        self.acked_byte_raw += packet.sent_bytes
+        self.acked_byte.add(packet.sent_bytes, self.rtt_estimate)
 
         if self.ssthresh is None or self.congestion_window < self.ssthresh:
             # slow start
@@ -220,11 +170,7 @@ class CubicCongestionControl(QuicCongestionControl):
         self.bytes_in_flight += packet.sent_bytes
 
         # monitoring
-        self.sent_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-
-        self.sent_byte_raw += packet.sent_bytes
+        self.sent_byte.add(packet.sent_bytes, self.rtt_estimate)
 
         if self.last_ack == 0.0:
             return
@@ -242,10 +188,7 @@ class CubicCongestionControl(QuicCongestionControl):
             self.bytes_in_flight -= packet.sent_bytes
             lost_largest_time = packet.sent_time
             # monitoring
-            self.lost_byte_in_interval += packet.sent_bytes * (
-                self.rtt_estimate / self.sampling_interval
-            )
-            self.lost_byte_raw += packet.sent_bytes
+            self.lost_byte.add(packet.sent_bytes, self.rtt_estimate)
 
         # start a new congestion event if packet was sent after the
         # start of the previous congestion recovery period.
@@ -288,6 +231,9 @@ class CubicCongestionControl(QuicCongestionControl):
         # monitoring
         self.rtt_estimate = rtt
 
+    def close(self) -> None:
+        self.logger.stop()
+
     def get_log_data(self) -> Dict[str, Any]:
         data = super().get_log_data()
 
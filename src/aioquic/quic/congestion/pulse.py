@@ -1,27 +1,37 @@
-import asyncio
-from collections import deque
-import csv
-from enum import Enum, auto
+import importlib
 import math
-import os
-import time
-import threading
-from typing import Any, Dict, Iterable
+from enum import Enum, auto
+from typing import Iterable
 
-from matplotlib import pyplot as plt
-from matplotlib.widgets import TextBox
 import numpy as np
-import zmq
-
-from AnalyzerUnit import AnalyzerUnit
+import TickScheduler
 import TimestampLogger
+from AnalyzerUnit import AnalyzerUnit, WindowExtremum
 
 from ..packet_builder import QuicSentPacket
 from .base import (
+    K_MINIMUM_WINDOW,
     QuicCongestionControl,
     QuicRttMonitor,
     register_congestion_control,
 )
+from .waveform import create_waveform
+
+# the modulation has to move whole datagrams to show up in the ACK response
+K_MIN_PROBE_DATAGRAMS = 2
+
+# shallow buffer mitigation, per analyzer window
+K_MITIGATION_BACKOFF = 0.5
+K_MITIGATION_RECOVERY = 0.1
+# loss counts as overflow when the upper half of the waveform loses at this
+# many times the rate of the lower half, by this many standard deviations of
+# random loss, which hits both halves alike
+K_MITIGATION_PEAK_EXCESS = 1.5
+K_MITIGATION_PEAK_SIGMA = 2
+
+# adaptive amplitude, per analyzer window
+K_AMPLITUDE_SHRINK = 0.7
+K_AMPLITUDE_GROWTH = 1.5
 
 
 class OperationState(Enum):
@@ -37,223 +47,429 @@ class PulseCongestionControl(QuicCongestionControl):
     New PULSE congestion control.
     """
 
-    def __init__(self, *, max_datagram_size: int, external_config) -> None:
+    def __init__(self, *, max_datagram_size: int, external_config, clock=None) -> None:
         super().__init__(max_datagram_size=max_datagram_size)
         self._max_datagram_size = max_datagram_size
         self._congestion_recovery_start_time = 0.0
         self._congestion_stash = 0
         self._rtt_monitor = QuicRttMonitor()
-        self._start_time = time.monotonic()
+        self._clock = clock if clock is not None else TickScheduler.loop_clock()
+        self._start_time = self._clock()
 
         self._base_cwnd = float(external_config["cca"]["cwnd_base_0"])
         self._base_to_amplitude_ratio = float(
             external_config["cca"]["base_to_amplitude_ratio"]
         )
+        # retune the amplitude from the spread of the response ratio: shrink
+        # it while the estimate is steady, grow it when noise drowns it
+        self.adaptive_amplitude = external_config["cca"].get(
+            "adaptive_amplitude", False
+        )
+        self._probe_amplitude_ratio = self._base_to_amplitude_ratio
+        self._amplitude_t = self._clock()
+        self.min_amplitude_ratio = float(
+            external_config["cca"].get("min_amplitude_ratio", 0.05)
+        )
+        self.max_amplitude_ratio = float(
+            external_config["cca"].get("max_amplitude_ratio", 0.5)
+        )
+        self.amplitude_spread_low = float(
+            external_config["cca"].get("amplitude_spread_low", 0.03)
+        )
+        self.amplitude_spread_high = float(
+            external_config["cca"].get("amplitude_spread_high", 0.1)
+        )
         self._frequency = float(external_config["cca"]["mod_rate"])
         self.sampling_interval = 1 / float(external_config["cca"]["sampling_rate"])
 
         self.rtt_estimate = external_config["cca"]["initial_rtt"]
         self.latest_rtt = external_config["cca"]["initial_rtt"]
+        self._first_rtt_time = None
         self.phi = external_config["cca"]["phi"]
         self.increase_percentile = external_config["cca"]["increase_percentile"]
         self.waveform = external_config["cca"]["waveform"]
-
-        self.acked_bytes_in_interval = 0
-        self.sent_bytes_in_interval = 0
-        self.lost_byte_in_interval = 0
-
-        self.acked_byte_raw = 0
-        self.sent_byte_raw = 0
-        self.lost_byte_raw = 0
+        # modules registering additional waveforms, e.g. for benchmarking
+        for module in external_config["cca"].get("waveform_plugins", []):
+            importlib.import_module(module)
+        self._waveform = create_waveform(
+            self.waveform, frequency=self._frequency, config=external_config["cca"]
+        )
+        # "timer" steps the window from a task, "event" on every packet event
+        self.modulation = external_config["cca"].get("modulation", "timer")
+        # "cwnd" paces at cwnd / srtt as of the last ACK, "modulated" at the
+        # instantaneous window over the latest RTT
+        self.pacing = external_config["cca"].get("pacing", "cwnd")
+        # scale down the upper half of the waveform while the path drops
+        # packets, the peaks are what overflows small queues
+        self.shallow_buffer_mitigation = external_config["cca"].get(
+            "shallow_buffer_mitigation", False
+        )
+        self.mitigation_loss_threshold = float(
+            external_config["cca"].get("mitigation_loss_threshold", 0.001)
+        )
+        self.min_upper_amplitude = float(
+            external_config["cca"].get("min_upper_amplitude", 0.25)
+        )
+        self._upper_amplitude = 1.0
+        self._mitigation_t = self._clock()
+        # bytes sent and lost in the lower and upper half of the waveform
+        self._half_sent = [0, 0]
+        self._half_lost = [0, 0]
+        # back off the base once per recovery epoch while the analyzer's loss
+        # rate is above loss_rate_threshold
+        self.loss_reaction = external_config["cca"].get("loss_reaction", False)
+        self.loss_backoff = float(external_config["cca"].get("loss_backoff", 0.85))
+        self.loss_rate_threshold = float(
+            external_config["cca"].get("loss_rate_threshold", 0.05)
+        )
 
         self._operation_state = OperationState.STARTUP
-        self.state_start_t = time.monotonic()
-        self.supressed_loss = 0
+        self.state_start_t = self._clock()
         self.saved = False
         self.threshold = 0
         self.logger = TimestampLogger.TimestampLogger(
-            ui_out=True, external_config=external_config, algo_instance=self
+            ui_out=external_config["out"].get("ui_out", True),
+            external_config=external_config,
+            algo_instance=self,
+            clock=self._clock,
         )
 
         self._analyzer_unit = AnalyzerUnit(
             config=external_config,
         )
 
-        self.logger.set_direct_out(self._analyzer_unit.add_to_queue)
+        # "delivery_rate" uses the windowed max of per-ACK rate samples,
+        # "acked_byte" the max of the sampled acked bytes per interval
+        self.bdp_estimator = external_config["cca"].get(
+            "bdp_estimator", "delivery_rate"
+        )
+        self._max_bandwidth = WindowExtremum(
+            float(
+                external_config["cca"].get(
+                    "bandwidth_window",
+                    self._analyzer_unit.window * self.sampling_interval,
+                )
+            )
+        )
 
         self.logger.register_metric("cwnd", lambda: self.congestion_window)
-        self.logger.register_metric(
-            "acked_byte", lambda: self.acked_bytes_in_interval, self.reset_acked_byte
-        )
+        self.acked_byte = self.logger.register_counter("acked_byte")
         self.logger.register_metric("rtt", lambda: self.latest_rtt)
         self.logger.register_metric(
             "cwnd_base",
             lambda: self._base_cwnd,
         )
-        self.logger.register_metric(
-            "sent_byte",
-            lambda: self.sent_bytes_in_interval,
-            cleanup_function=self.reset_sent_byte,
-        )
-        self.logger.register_metric(
-            "lost_byte",
-            lambda: self.lost_byte_in_interval,
-            cleanup_function=self.reset_lost_byte,
-        )
-
-        mod = asyncio.create_task(self.modulate_congestion_window())
-        mod.add_done_callback(
-            lambda t: print("TASK FINISHED:", t, "EXCEPTION:", t.exception())
-        )
-        t = asyncio.create_task(self.logger.pass_timestamps())
-        t.add_done_callback(
-            lambda t: print("TASK FINISHED:", t, "EXCEPTION:", t.exception())
-        )
-        c = asyncio.create_task(self.control())
-        c.add_done_callback(
-            lambda t: print("TASK FINISHED:", t, "EXCEPTION:", t.exception())
+        self.sent_byte = self.logger.register_counter("sent_byte")
+        self.lost_byte = self.logger.register_counter("lost_byte")
+
+        self.update_congestion_window(self._start_time)
+        scheduler = TickScheduler.get_scheduler()
+        self._ticks = []
+        if self.modulation == "timer":
+            self._ticks.append(
+                scheduler.register(
+                    self.sampling_interval, self.modulate_congestion_window
+                )
+            )
+        self.logger.start()
+        # the analyzer samples at the controller rate, whatever the log_rate
+        self._analyzer_sampler = self.logger.registry.sampler(
+            self.logger.columns, self.sampling_interval
         )
+        self._analyzer_row = np.zeros(len(self.logger.columns))
+        self._analyzer_raw_row = np.zeros(len(self.logger.columns))
+        self._ticks.append(scheduler.register(self.sampling_interval, self.control))
         print("config read @PULSE")
 
-    def get_acked_byte_raw(self):
-        temp = self.acked_byte_raw
-        self.acked_byte_raw = 0
-        return temp
-
-    def get_sent_byte_raw(self):
-        temp = self.sent_byte_raw
-        self.sent_byte_raw = 0
-        return temp
-
-    def get_lost_byte_raw(self):
-        temp = self.lost_byte_raw
-        self.lost_byte_raw = 0
-        return temp
-
-    def reset_acked_byte(self):
-        self.acked_bytes_in_interval = 0
-
-    def reset_sent_byte(self):
-        self.sent_bytes_in_interval = 0
-
-    def reset_lost_byte(self):
-        self.lost_byte_in_interval = 0
-
     def get_cwnd_base_next_step(self):
+        # grow as fast as the quickest probe tone can resolve the response
         next = self._base_cwnd * (
-            1 + 2 * math.pi * self._base_to_amplitude_ratio * self._frequency * self.phi
+            1
+            + 2
+            * math.pi
+            * self._base_to_amplitude_ratio
+            * self._waveform.max_frequency
+            * self.phi
         )
 
         return next
 
+    def get_bdp_estimate(self):
+        acked_estimate = self._analyzer_unit.get_bdp_estimate()
+        if self.bdp_estimator == "delivery_rate":
+            bandwidth = self._max_bandwidth.get()
+            if bandwidth is not None:
+                estimate = bandwidth * self.rtt_estimate
+                # an unsaturated path only delivers what the window allows,
+                # the rate samples are a lower bound there
+                if acked_estimate is not None and (
+                    np.mean(self._analyzer_unit.congwin_to_response_ratio) < 0.4
+                ):
+                    return max(estimate, acked_estimate)
+                return estimate
+        return acked_estimate
+
     def change_operation_state(self, state: OperationState):
-        if state == OperationState.SENSE:
-            self.supressed_loss = 0
-        self.state_start_t = time.monotonic()
+        self.state_start_t = self._clock()
         self._operation_state = state
         print("Switching to: ", state)
 
     def state_active_over(self, t):
-        return time.monotonic() - self.state_start_t > t
+        return self._clock() - self.state_start_t > t
+
+    def in_upper_half(self, t: float) -> int:
+        return int(self.get_periodic_component(t - self._start_time) > 0)
+
+    def peak_loss(self):
+        """
+        Whether the losses since the last reaction are overflow at the peaks
+        rather than random loss.
+        """
+        if self._half_sent[1] == 0:
+            return False
+        rate_low = self._half_lost[0] / self._half_sent[0] if self._half_sent[0] else 0
+        rate_high = self._half_lost[1] / self._half_sent[1]
+        if (
+            rate_high <= self.mitigation_loss_threshold
+            or rate_high <= K_MITIGATION_PEAK_EXCESS * rate_low
+        ):
+            return False
+        # random loss would hit the upper half in proportion to its traffic
+        lost = sum(self._half_lost) / self._max_datagram_size
+        share = self._half_sent[1] / sum(self._half_sent)
+        excess = self._half_lost[1] / self._max_datagram_size - lost * share
+        return excess > K_MITIGATION_PEAK_SIGMA * math.sqrt(lost * share * (1 - share))
+
+    def mitigate_shallow_buffer(self):
+        # INCREASE reads the full peaks, only shape them once CORRECT has
+        # set a base
+        if self._operation_state not in (OperationState.SENSE, OperationState.STATIC):
+            self._half_sent = [0, 0]
+            self._half_lost = [0, 0]
+            self._mitigation_t = self._clock()
+            return
+        # the counts need an analyzer window of traffic, react once per window
+        if (
+            self._clock() - self._mitigation_t
+            < self._analyzer_unit.window * self.sampling_interval
+        ):
+            return
+
+        # the scaled peaks have to stay resolvable in whole datagrams
+        floor = max(
+            self.min_upper_amplitude,
+            min(
+                1.0,
+                K_MIN_PROBE_DATAGRAMS
+                * self._max_datagram_size
+                / (self._base_cwnd * self._base_to_amplitude_ratio),
+            ),
+        )
+        upper_amplitude = self._upper_amplitude
+        if self.peak_loss():
+            upper_amplitude = max(floor, upper_amplitude * K_MITIGATION_BACKOFF)
+        elif upper_amplitude < 1:
+            upper_amplitude = min(1.0, upper_amplitude + K_MITIGATION_RECOVERY)
+        self._half_sent = [0, 0]
+        self._half_lost = [0, 0]
+        self._mitigation_t = self._clock()
+        if upper_amplitude == self._upper_amplitude:
+            return
+        self._upper_amplitude = upper_amplitude
+        self._analyzer_unit.upper_amplitude = upper_amplitude
+        print("UPPER AMPLITUDE SET TO:", upper_amplitude)
+
+    def set_amplitude_ratio(self, ratio):
+        self._base_to_amplitude_ratio = ratio
+        self._analyzer_unit.base_to_amplitude_ratio = ratio
+        self._amplitude_t = self._clock()
+        print("AMPLITUDE RATIO SET TO:", ratio)
+
+    def amplitude_settled(self):
+        # one window to flush the samples of the previous amplitude from the
+        # analyzer, one more for the ratios computed from them
+        return (
+            self._clock() - self._amplitude_t
+            > 2 * self._analyzer_unit.window * self.sampling_interval
+        )
 
-    async def control(self):
-        while True:
-            self._analyzer_unit.update_processing()
-            match (self._operation_state):
-                case OperationState.STARTUP:
-                    if (
-                        self.state_active_over(
-                            self._analyzer_unit.input_queue.maxlen
-                            * self.sampling_interval
-                        )
-                        * 2
-                    ):
-                        self.rtt_estimate = self._analyzer_unit.get_rtt_estimate()
-
-                        self.change_operation_state(OperationState.INCREASE)
-                case OperationState.INCREASE:
-                    self._base_cwnd = self.get_cwnd_base_next_step()
-                    mean = np.percentile(
-                        self._analyzer_unit.congwin_to_response_ratio,
-                        self.increase_percentile,
+    def adapt_amplitude(self):
+        # only judge ratios that were all taken in STATIC
+        if not self.amplitude_settled() or not self.state_active_over(
+            self._analyzer_unit.window * self.sampling_interval
+        ):
+            return
+
+        # the modulation has to stay resolvable in whole datagrams
+        floor = max(
+            self.min_amplitude_ratio,
+            K_MIN_PROBE_DATAGRAMS * self._max_datagram_size / self._base_cwnd,
+        )
+        spread = np.std(self._analyzer_unit.congwin_to_response_ratio)
+        if spread < self.amplitude_spread_low:
+            ratio = max(floor, self._base_to_amplitude_ratio * K_AMPLITUDE_SHRINK)
+        elif spread > self.amplitude_spread_high:
+            ratio = min(
+                self.max_amplitude_ratio,
+                self._base_to_amplitude_ratio * K_AMPLITUDE_GROWTH,
+            )
+        else:
+            return
+        if ratio != self._base_to_amplitude_ratio:
+            self.set_amplitude_ratio(ratio)
+
+    def sample_analyzer(self):
+        row = self._analyzer_row
+        row[0] = self._clock() - self._start_time
+        self._analyzer_sampler.sample(row, self._analyzer_raw_row)
+        self._analyzer_unit.add_to_queue(row)
+
+    def control(self):
+        self.sample_analyzer()
+        self._analyzer_unit.update_processing()
+        if self.shallow_buffer_mitigation:
+            self.mitigate_shallow_buffer()
+        if self.adaptive_amplitude and self._operation_state == OperationState.STATIC:
+            self.adapt_amplitude()
+        match self._operation_state:
+            case OperationState.STARTUP:
+                # the window must only hold measured RTTs, not initial_rtt
+                measured = (
+                    self._first_rtt_time is not None
+                    and self._clock() - self._first_rtt_time
+                    > self._analyzer_unit.window * self.sampling_interval
+                )
+                if (
+                    self.state_active_over(
+                        self._analyzer_unit.window * self.sampling_interval * 2
                     )
-                    if mean > 0.5:
-                        print(self._base_cwnd)
-                        self.change_operation_state(OperationState.CORRECT)
-                case OperationState.STATIC:
-                    mean = np.mean(self._analyzer_unit.congwin_to_response_ratio)
-                    if mean < 0.4:
-                        self.change_operation_state(OperationState.CORRECT)
-                    elif mean > 0.5:
-                        self.change_operation_state(OperationState.CORRECT)
-                case OperationState.CORRECT:
-                    base = self._analyzer_unit.get_bdp_estimate()
-                    if base is not None:
-                        print(
-                            "STEP DOWN" if self._base_cwnd > base else "STEP UP",
-                            "BASE SET TO:",
-                            base,
-                        )
-                        self._base_cwnd = base
-                    self.change_operation_state(OperationState.SENSE)
-                case OperationState.SENSE:
+                    and measured
+                ):
                     self.rtt_estimate = self._analyzer_unit.get_rtt_estimate()
 
-                    if self.state_active_over(
-                        self._analyzer_unit.input_queue.maxlen * self.sampling_interval
+                    self.change_operation_state(OperationState.INCREASE)
+            case OperationState.INCREASE:
+                self._base_cwnd = self.get_cwnd_base_next_step()
+                mean = np.percentile(
+                    self._analyzer_unit.congwin_to_response_ratio,
+                    self.increase_percentile,
+                )
+                resolvable = (
+                    self._base_cwnd * self._base_to_amplitude_ratio
+                    >= K_MIN_PROBE_DATAGRAMS * self._max_datagram_size
+                )
+                if mean > 0.5 and resolvable:
+                    print(self._base_cwnd)
+                    self.change_operation_state(OperationState.CORRECT)
+            case OperationState.STATIC:
+                mean = np.mean(self._analyzer_unit.congwin_to_response_ratio)
+                if (mean < 0.4 or mean > 0.5) and self.amplitude_settled():
+                    if (
+                        self.adaptive_amplitude
+                        and self._base_to_amplitude_ratio < self._probe_amplitude_ratio
                     ):
-                        self.change_operation_state(OperationState.STATIC)
-
-            await asyncio.sleep(self.sampling_interval)
-
-    async def modulate_congestion_window(self):
-        while True:
-            delta_t = time.monotonic() - self._start_time
-            periodic_component = None
-            match (self.waveform):
-                case "sine":
-                    periodic_component = math.sin(2 * math.pi * self._frequency * delta_t)
-                case "square":
-                    periodic_component = 1 if ((self._frequency * delta_t) % 1) < 0.5 else -1
-                case "triangle":
-                    periodic_component = 4 * abs((self._frequency * delta_t) % 1 - 0.5) - 1
-                case "saw":
-                    periodic_component = 2 * ((self._frequency * delta_t) % 1) - 1
-
-            amplitude = self._base_cwnd * self._base_to_amplitude_ratio
-            self.congestion_window = int(self._base_cwnd + amplitude * periodic_component)
-
-            await asyncio.sleep(self.sampling_interval)
+                        # the path changed, probe it at the configured amplitude
+                        self.set_amplitude_ratio(self._probe_amplitude_ratio)
+                    self.change_operation_state(OperationState.CORRECT)
+            case OperationState.CORRECT:
+                base = self.get_bdp_estimate()
+                if base is not None:
+                    print(
+                        "STEP DOWN" if self._base_cwnd > base else "STEP UP",
+                        "BASE SET TO:",
+                        base,
+                    )
+                    self._base_cwnd = base
+                self.change_operation_state(OperationState.SENSE)
+            case OperationState.SENSE:
+                self.rtt_estimate = self._analyzer_unit.get_rtt_estimate()
+
+                if self.state_active_over(
+                    self._analyzer_unit.window * self.sampling_interval
+                ):
+                    self.change_operation_state(OperationState.STATIC)
+
+    def get_periodic_component(self, delta_t: float) -> float:
+        return self._waveform.sample(delta_t)
+
+    def update_congestion_window(self, now: float) -> None:
+        periodic_component = self.get_periodic_component(now - self._start_time)
+        if periodic_component > 0:
+            periodic_component *= self._upper_amplitude
+        amplitude = self._base_cwnd * self._base_to_amplitude_ratio
+        self.congestion_window = int(self._base_cwnd + amplitude * periodic_component)
+        if self.pacing == "modulated":
+            self.pacing_rate = self.congestion_window / self.latest_rtt
+
+    def modulate_congestion_window(self):
+        self.update_congestion_window(self._clock())
 
     def on_packet_acked(self, *, now: float, packet: QuicSentPacket) -> None:
         self.bytes_in_flight -= packet.sent_bytes
-        self.acked_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-        self.acked_byte_raw += packet.sent_bytes
+        self.acked_byte.add(packet.sent_bytes, self.rtt_estimate)
+        if self.modulation == "event":
+            self.update_congestion_window(now)
 
     def on_packet_sent(self, *, packet: QuicSentPacket) -> None:
         self.bytes_in_flight += packet.sent_bytes
-        self.sent_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-
-        self.sent_byte_raw += packet.sent_bytes
+        self.sent_byte.add(packet.sent_bytes, self.rtt_estimate)
+        if self.shallow_buffer_mitigation:
+            self._half_sent[self.in_upper_half(packet.sent_time)] += packet.sent_bytes
+        if self.modulation == "event":
+            self.update_congestion_window(packet.sent_time)
 
     def on_packets_expired(self, *, packets: Iterable[QuicSentPacket]) -> None:
         for packet in packets:
             self.bytes_in_flight -= packet.sent_bytes
 
+    def on_congestion_event(self):
+        # in SENSE, CORRECT has just set the base and the loss predates it
+        match self._operation_state:
+            case OperationState.INCREASE:
+                print("LOSS IN INCREASE")
+                self.change_operation_state(OperationState.CORRECT)
+            case OperationState.STATIC:
+                self._base_cwnd = max(
+                    self._base_cwnd * self.loss_backoff,
+                    K_MINIMUM_WINDOW * self._max_datagram_size,
+                )
+                print("LOSS BACKOFF BASE SET TO:", self._base_cwnd)
+
     def on_packets_lost(self, *, now: float, packets: Iterable[QuicSentPacket]) -> None:
+        lost_largest_time = 0.0
         for packet in packets:
             self.bytes_in_flight -= packet.sent_bytes
-            self.lost_byte_in_interval += packet.sent_bytes * (
-                self.rtt_estimate / self.sampling_interval
-            )
-            self.lost_byte_raw += packet.sent_bytes
+            lost_largest_time = packet.sent_time
+            self.lost_byte.add(packet.sent_bytes, self.rtt_estimate)
+            if self.shallow_buffer_mitigation:
+                self._half_lost[self.in_upper_half(packet.sent_time)] += (
+                    packet.sent_bytes
+                )
+
+        # one reaction per congestion event, like Reno's recovery period
+        if (
+            self.loss_reaction
+            and lost_largest_time > self._congestion_recovery_start_time
+            and self._analyzer_unit.loss_rate[-1] > self.loss_rate_threshold
+        ):
+            self._congestion_recovery_start_time = now
+            self.on_congestion_event()
+        if self.modulation == "event":
+            self.update_congestion_window(now)
 
     def on_rtt_measurement(self, *, now: float, rtt: float) -> None:
+        if self._first_rtt_time is None:
+            self._first_rtt_time = now
         self.latest_rtt = rtt
 
+    def on_rate_sample(self, *, now: float, delivery_rate: float) -> None:
+        self._max_bandwidth.push(now, delivery_rate)
+
+    def close(self) -> None:
+        for tick in self._ticks:
+            tick.cancel()
+        self._ticks.clear()
+        self.logger.stop()
+
 
 register_congestion_control("pulse", PulseCongestionControl)
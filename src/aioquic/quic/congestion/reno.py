@@ -1,4 +1,3 @@
-import asyncio
 from typing import Iterable
 
 import TimestampLogger
@@ -28,75 +27,26 @@ class RenoCongestionControl(QuicCongestionControl):
 
         # addded for monitoring
 
-        self.acked_bytes_in_interval = 0
-        self.sent_bytes_in_interval = 0
-        self.lost_byte_in_interval = 0
-
-        self.acked_byte_raw = 0
-        self.sent_byte_raw = 0
-        self.lost_byte_raw = 0
-
         self.rtt_estimate = 0.1
-        self.sampling_interval = 1 / float(external_config["cca"]["sampling_rate"])
         self.logger = TimestampLogger.TimestampLogger(
-            ui_out=True, external_config=external_config, algo_instance=self
+            ui_out=external_config["out"].get("ui_out", True),
+            external_config=external_config,
+            algo_instance=self,
         )
 
         self.logger.register_metric("cwnd", lambda: self.congestion_window)
-        self.logger.register_metric(
-            "acked_byte",
-            lambda: self.acked_bytes_in_interval,
-            self.reset_acked_byte,
-        )
+        self.acked_byte = self.logger.register_counter("acked_byte")
         self.logger.register_metric("rtt", lambda: self.rtt_estimate)
-        self.logger.register_metric(
-            "sent_byte",
-            lambda: self.sent_bytes_in_interval,
-            cleanup_function=self.reset_sent_byte,
-        )
-        self.logger.register_metric(
-            "lost_byte",
-            lambda: self.lost_byte_in_interval,
-            cleanup_function=self.reset_lost_byte,
-        )
-
-        t = asyncio.create_task(self.logger.pass_timestamps())
-        t.add_done_callback(
-            lambda t: print("TASK FINISHED:", t, "EXCEPTION:", t.exception())
-        )
-
-    def get_acked_byte_raw(self):
-        temp = self.acked_byte_raw
-        self.acked_byte_raw = 0
-        return temp
-
-    def get_sent_byte_raw(self):
-        temp = self.sent_byte_raw
-        self.sent_byte_raw = 0
-        return temp
+        self.sent_byte = self.logger.register_counter("sent_byte")
+        self.lost_byte = self.logger.register_counter("lost_byte")
 
-    def get_lost_byte_raw(self):
-        temp = self.lost_byte_raw
-        self.lost_byte_raw = 0
-        return temp
-
-    def reset_acked_byte(self):
-        self.acked_bytes_in_interval = 0
-
-    def reset_sent_byte(self):
-        self.sent_bytes_in_interval = 0
-
-    def reset_lost_byte(self):
-        self.lost_byte_in_interval = 0
+        self.logger.start()
 
     def on_packet_acked(self, *, now: float, packet: QuicSentPacket) -> None:
         self.bytes_in_flight -= packet.sent_bytes
 
         # added for monitoring
-        self.acked_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-        self.acked_byte_raw += packet.sent_bytes
+        self.acked_byte.add(packet.sent_bytes, self.rtt_estimate)
 
         # don't increase window in congestion recovery
         if packet.sent_time <= self._congestion_recovery_start_time:
@@ -117,11 +67,7 @@ class RenoCongestionControl(QuicCongestionControl):
         self.bytes_in_flight += packet.sent_bytes
 
         # monitoring
-        self.sent_bytes_in_interval += packet.sent_bytes * (
-            self.rtt_estimate / self.sampling_interval
-        )
-
-        self.sent_byte_raw += packet.sent_bytes
+        self.sent_byte.add(packet.sent_bytes, self.rtt_estimate)
 
     def on_packets_expired(self, *, packets: Iterable[QuicSentPacket]) -> None:
         for packet in packets:
@@ -134,10 +80,7 @@ class RenoCongestionControl(QuicCongestionControl):
             self.bytes_in_flight -= packet.sent_bytes
             lost_largest_time = packet.sent_time
             # monitoring
-            self.lost_byte_in_interval += packet.sent_bytes * (
-                self.rtt_estimate / self.sampling_interval
-            )
-            self.lost_byte_raw += packet.sent_bytes
+            self.lost_byte.add(packet.sent_bytes, self.rtt_estimate)
 
         # start a new congestion event if packet was sent after the
         # start of the previous congestion recovery period.
@@ -161,5 +104,8 @@ class RenoCongestionControl(QuicCongestionControl):
         # monitoring
         self.rtt_estimate = rtt
 
+    def close(self) -> None:
+        self.logger.stop()
+
 
 register_congestion_control("reno", RenoCongestionControl)
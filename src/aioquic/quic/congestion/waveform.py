@@ -0,0 +1,172 @@
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+K_TABLE_SIZE = 1024
+
+
+class QuicWaveform:
+    """
+    Periodic modulation signal in [-1, 1], read from a lookup table holding
+    one period, indexed by a phase accumulator. `max_frequency` is the
+    highest frequency the signal probes the path with.
+    """
+
+    def __init__(
+        self,
+        *,
+        table: Sequence[float],
+        frequency: float,
+        max_frequency: Optional[float] = None,
+    ) -> None:
+        self.table = list(table)
+        self.frequency = frequency
+        self.max_frequency = frequency if max_frequency is None else max_frequency
+
+        self._phase = 0.0
+        self._time = 0.0
+
+    def sample(self, t: float) -> float:
+        """
+        Return the value at time `t`, relative to the start of the modulation.
+        """
+        self._phase = (self._phase + (t - self._time) * self.frequency) % 1.0
+        self._time = t
+        return self.table[int(self._phase * len(self.table)) % len(self.table)]
+
+
+QuicWaveformFactory = Callable[..., QuicWaveform]
+
+_factories: Dict[str, QuicWaveformFactory] = {}
+
+
+def create_waveform(
+    name: str, *, frequency: float, config: Optional[Dict[str, Any]] = None
+) -> QuicWaveform:
+    """
+    Create an instance of the `name` waveform with a base frequency of
+    `frequency` Hz. `config` holds the options of parametrised waveforms.
+    """
+    try:
+        factory = _factories[name]
+    except KeyError:
+        raise ValueError(f"Unknown waveform: {name}")
+    return factory(frequency=frequency, config=config or {})
+
+
+def register_waveform(name: str, factory: QuicWaveformFactory) -> None:
+    """
+    Register a waveform named `name`.
+    """
+    _factories[name] = factory
+
+
+def tabulate(
+    function: Callable[[float], float], size: int = K_TABLE_SIZE
+) -> List[float]:
+    """
+    Sample `function` over one period, given as a phase in [0, 1).
+    """
+    return [function(i / size) for i in range(size)]
+
+
+def normalise(table: List[float]) -> List[float]:
+    peak = max(abs(value) for value in table)
+    if peak == 0:
+        return table
+    return [value / peak for value in table]
+
+
+def periodic(function: Callable[[float], float]) -> QuicWaveformFactory:
+    """
+    Wrap a single period `function` into a factory.
+    """
+    table = tabulate(function)
+
+    def factory(*, frequency: float, config: Dict[str, Any]) -> QuicWaveform:
+        return QuicWaveform(table=table, frequency=frequency)
+
+    return factory
+
+
+def chirp(*, frequency: float, config: Dict[str, Any]) -> QuicWaveform:
+    """
+    Linear sweep from `chirp_start` to `chirp_end` times the base frequency,
+    repeated every `chirp_periods` periods of the base frequency.
+    """
+    start = float(config.get("chirp_start", 0.5))
+    end = float(config.get("chirp_end", 4))
+    periods = float(config.get("chirp_periods", 4))
+
+    # phase in cycles of the base frequency over one sweep
+    def sweep(x: float) -> float:
+        t = x * periods
+        return math.sin(2 * math.pi * (start * t + (end - start) * t * x / 2))
+
+    return QuicWaveform(
+        table=tabulate(sweep),
+        frequency=frequency / periods,
+        max_frequency=frequency * max(start, end),
+    )
+
+
+def multitone(*, frequency: float, config: Dict[str, Any]) -> QuicWaveform:
+    """
+    Sum of sines at the integer multiples `tones` of the base frequency with
+    the relative `tone_gains`, scaled back to a peak of 1.
+    """
+    tones = [int(tone) for tone in config.get("tones", [1, 2])]
+    gains = [float(gain) for gain in config.get("tone_gains", [1] * len(tones))]
+
+    def tone_sum(x: float) -> float:
+        return sum(
+            gain * math.sin(2 * math.pi * tone * x) for tone, gain in zip(tones, gains)
+        )
+
+    return QuicWaveform(
+        table=normalise(tabulate(tone_sum)),
+        frequency=frequency,
+        max_frequency=frequency * max(tones),
+    )
+
+
+def prbs(*, frequency: float, config: Dict[str, Any]) -> QuicWaveform:
+    """
+    Maximum length sequence from a Fibonacci LFSR of `prbs_order`, one chip
+    per period of the base frequency.
+    """
+    order = int(config.get("prbs_order", 7))
+    taps = {
+        2: (2, 1),
+        3: (3, 2),
+        4: (4, 3),
+        5: (5, 3),
+        6: (6, 5),
+        7: (7, 6),
+        8: (8, 6, 5, 4),
+        9: (9, 5),
+        10: (10, 7),
+    }
+    if order not in taps:
+        raise ValueError(f"Unsupported PRBS order: {order}")
+
+    state = (1 << order) - 1
+    chips = []
+    for _ in range((1 << order) - 1):
+        chips.append(1.0 if state & 1 else -1.0)
+        bit = 0
+        for tap in taps[order]:
+            bit ^= (state >> (order - tap)) & 1
+        state = (state >> 1) | (bit << (order - 1))
+
+    return QuicWaveform(
+        table=chips, frequency=frequency / len(chips), max_frequency=frequency
+    )
+
+
+register_waveform("sine", periodic(lambda x: math.sin(2 * math.pi * x)))
+register_waveform("square", periodic(lambda x: 1.0 if x < 0.5 else -1.0))
+register_waveform("triangle", periodic(lambda x: 4 * abs(x - 0.5) - 1))
+register_waveform("saw", periodic(lambda x: 2 * x - 1))
+register_waveform("chirp", chirp)
+register_waveform("multitone", multitone)
+register_waveform("prbs", prbs)
@@ -1270,6 +1270,7 @@ class QuicConnection:
         self._close_at = None
         for epoch in self._spaces.keys():
             self._discard_epoch(epoch)
+        self._loss.close()
         self._events.append(self._close_event)
         self._set_state(QuicConnectionState.TERMINATED)
 
@@ -39,6 +39,11 @@ class QuicSentPacket:
     sent_time: Optional[float] = None
     sent_bytes: int = 0
 
+    # delivery rate sampling state at the time the packet was sent
+    delivered: int = 0
+    delivered_time: float = 0.0
+    first_sent_time: float = 0.0
+
     delivery_handlers: List[Tuple[QuicDeliveryHandler, Any]] = field(
         default_factory=list
     )
@@ -1,6 +1,19 @@
+import itertools
 import logging
 import math
-from typing import Any, Callable, Dict, Iterable, List, Optional
+import os
+import struct
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 from .congestion import cubic, reno, pulse, reno_default  # noqa
 from .congestion.base import K_GRANULARITY, create_congestion_control
@@ -14,6 +27,14 @@ K_TIME_THRESHOLD = 9 / 8
 K_MICRO_SECOND = 0.000001
 K_SECOND = 1.0
 
+# packet trace events
+K_PACKET_TRACE_SENT = 0
+K_PACKET_TRACE_ACKED = 1
+K_PACKET_TRACE_LOST = 2
+
+# tells the packet traces of the connections in one process apart
+_packet_trace_counter = itertools.count()
+
 
 class QuicPacketSpace:
     def __init__(self) -> None:
@@ -61,8 +82,19 @@ class QuicPacketPacer:
             )
             self.evaluation_time = now
 
-    def update_rate(self, congestion_window: int, smoothed_rtt: float) -> None:
-        pacing_rate = congestion_window / max(smoothed_rtt, K_MICRO_SECOND)
+    def update_rate(
+        self,
+        congestion_window: int,
+        smoothed_rtt: float,
+        pacing_rate: Optional[float] = None,
+    ) -> None:
+        """
+        Derive the pacing rate from the congestion window, unless the
+        congestion control requests an explicit `pacing_rate` in bytes/s.
+        """
+        if pacing_rate is None:
+            pacing_rate = congestion_window / max(smoothed_rtt, K_MICRO_SECOND)
+        pacing_rate = max(pacing_rate, K_MICRO_SECOND)
         self.packet_time = max(
             K_MICRO_SECOND, min(self._max_datagram_size / pacing_rate, K_SECOND)
         )
@@ -78,6 +110,138 @@ class QuicPacketPacer:
             self.bucket_time = self.bucket_max
 
 
+class QuicDeliveryRateEstimator:
+    """
+    Per-ACK delivery rate sampling, see
+    https://datatracker.ietf.org/doc/html/draft-cheng-iccrg-delivery-rate-estimation
+    """
+
+    def __init__(self) -> None:
+        self.delivered = 0
+        self.delivered_time = 0.0
+        self.first_sent_time = 0.0
+
+        self._prior_delivered: Optional[int] = None
+        self._prior_time = 0.0
+        self._send_elapsed = 0.0
+
+    def on_packet_sent(self, *, packet: QuicSentPacket, bytes_in_flight: int) -> None:
+        if bytes_in_flight == 0:
+            self.first_sent_time = packet.sent_time
+            self.delivered_time = packet.sent_time
+
+        packet.delivered = self.delivered
+        packet.delivered_time = self.delivered_time
+        packet.first_sent_time = self.first_sent_time
+
+    def on_packet_acked(self, *, packet: QuicSentPacket, now: float) -> None:
+        self.delivered += packet.sent_bytes
+        self.delivered_time = now
+
+        # the sample is taken from the most recently sent packet
+        if self._prior_delivered is None or packet.delivered > self._prior_delivered:
+            self._prior_delivered = packet.delivered
+            self._prior_time = packet.delivered_time
+            self._send_elapsed = packet.sent_time - packet.first_sent_time
+            self.first_sent_time = packet.sent_time
+
+    def generate_rate_sample(self, *, min_rtt: float) -> Optional[float]:
+        """
+        Return the delivery rate in bytes per second for the packets acked
+        since the previous call, or `None` if there is no valid sample.
+        """
+        if self._prior_delivered is None:
+            return None
+
+        delivered = self.delivered - self._prior_delivered
+        interval = max(self._send_elapsed, self.delivered_time - self._prior_time)
+        self._prior_delivered = None
+
+        # intervals shorter than the minimum RTT underestimate the send time
+        if interval <= 0 or interval < min_rtt:
+            return None
+        return delivered / interval
+
+
+class QuicPacketTrace:
+    """
+    Per packet send / ack / loss records in a preallocated ring buffer, the
+    oldest records are overwritten once `capacity` is reached.
+
+    A record is event, epoch, sent_bytes, packet_number, time, sent_time,
+    congestion_window and bytes_in_flight, packed as `RECORD`.
+    """
+
+    RECORD = struct.Struct("<BBxxIQddqq")
+
+    def __init__(self, *, capacity: int = 65536, path: Optional[str] = None) -> None:
+        if capacity < 1:
+            raise ValueError("Packet trace capacity must be at least 1")
+        self.capacity = capacity
+        self.path = path
+        self._buffer = bytearray(capacity * self.RECORD.size)
+        self._index = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
+
+    def record(
+        self,
+        *,
+        event: int,
+        now: float,
+        packet: QuicSentPacket,
+        congestion_window: int,
+        bytes_in_flight: int,
+    ) -> None:
+        self.RECORD.pack_into(
+            self._buffer,
+            self._index * self.RECORD.size,
+            event,
+            packet.epoch.value,
+            packet.sent_bytes,
+            packet.packet_number,
+            now,
+            packet.sent_time,
+            congestion_window,
+            bytes_in_flight,
+        )
+        self._index = (self._index + 1) % self.capacity
+        self._count += 1
+
+    def to_bytes(self) -> bytes:
+        """
+        Return the records held, oldest first.
+        """
+        if self._count < self.capacity:
+            return bytes(self._buffer[: self._index * self.RECORD.size])
+        split = self._index * self.RECORD.size
+        return bytes(self._buffer[split:] + self._buffer[:split])
+
+    def dump(self, fp: Optional[BinaryIO] = None) -> None:
+        """
+        Write the records to `fp`, or to `path` if no file is given.
+        """
+        if fp is None:
+            if self.path is None:
+                raise ValueError("No file given and the trace has no path")
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "wb") as f:
+                f.write(self.to_bytes())
+        else:
+            fp.write(self.to_bytes())
+
+    @classmethod
+    def parse(cls, data: bytes) -> Iterator[Tuple]:
+        """
+        Unpack dumped records.
+        """
+        return cls.RECORD.iter_unpack(data)
+
+
 class QuicPacketRecovery:
     """
     Packet loss and congestion controller.
@@ -93,6 +257,7 @@ class QuicPacketRecovery:
         send_probe: Callable[[], None],
         logger: Optional[logging.LoggerAdapter] = None,
         quic_logger: Optional[QuicLoggerTrace] = None,
+        packet_trace: Optional[QuicPacketTrace] = None,
         external_config,
     ) -> None:
         self.max_ack_delay = 0.025
@@ -103,6 +268,23 @@ class QuicPacketRecovery:
         self._logger = logger
         self._quic_logger = quic_logger
         self._send_probe = send_probe
+        if (
+            packet_trace is None
+            and external_config is not None
+            and external_config["out"].get("packet_trace", False)
+        ):
+            packet_trace = QuicPacketTrace(
+                capacity=int(
+                    external_config["out"].get("packet_trace_capacity", 65536)
+                ),
+                # one file per connection, client and server may share a config
+                path=(
+                    f"../data_out/{external_config['cca']['name']}/"
+                    f"{external_config['out']['filename']}_{os.getpid()}_"
+                    f"{next(_packet_trace_counter)}_packets.bin"
+                ),
+            )
+        self._packet_trace = packet_trace
 
         # loss detection
         self._pto_count = 0
@@ -121,6 +303,8 @@ class QuicPacketRecovery:
             external_config=external_config,
         )
         self._pacer = QuicPacketPacer(max_datagram_size=max_datagram_size)
+        self._pacing_rate: Optional[float] = None
+        self._rate_estimator = QuicDeliveryRateEstimator()
 
     @property
     def bytes_in_flight(self) -> int:
@@ -130,6 +314,15 @@ class QuicPacketRecovery:
     def congestion_window(self) -> int:
         return self._cc.congestion_window
 
+    def close(self) -> None:
+        """
+        Release the resources held by the congestion controller and dump the
+        packet trace.
+        """
+        self._cc.close()
+        if self._packet_trace is not None and self._packet_trace.path is not None:
+            self._packet_trace.dump()
+
     def discard_space(self, space: QuicPacketSpace) -> None:
         assert space in self.spaces
 
@@ -202,7 +395,10 @@ class QuicPacketRecovery:
                     is_ack_eliciting = True
                     space.ack_eliciting_in_flight -= 1
                 if packet.in_flight:
+                    self._rate_estimator.on_packet_acked(packet=packet, now=now)
                     self._cc.on_packet_acked(packet=packet, now=now)
+                if self._packet_trace is not None:
+                    self._trace_packet(K_PACKET_TRACE_ACKED, now, packet)
                 largest_newly_acked = packet_number
                 largest_sent_time = packet.sent_time
 
@@ -242,14 +438,17 @@ class QuicPacketRecovery:
 
             # inform congestion controller
             self._cc.on_rtt_measurement(now=now, rtt=latest_rtt)
-            self._pacer.update_rate(
-                congestion_window=self._cc.congestion_window,
-                smoothed_rtt=self._rtt_smoothed,
-            )
+            self._update_pacing_rate()
 
         else:
             log_rtt = False
 
+        delivery_rate = self._rate_estimator.generate_rate_sample(
+            min_rtt=self._rtt_min if self._rtt_initialized else 0.0
+        )
+        if delivery_rate is not None:
+            self._cc.on_rate_sample(now=now, delivery_rate=delivery_rate)
+
         self._detect_loss(now=now, space=space)
 
         # reset PTO count
@@ -276,11 +475,24 @@ class QuicPacketRecovery:
                 self._time_of_last_sent_ack_eliciting_packet = packet.sent_time
 
             # add packet to bytes in flight
+            self._rate_estimator.on_packet_sent(
+                packet=packet, bytes_in_flight=self._cc.bytes_in_flight
+            )
             self._cc.on_packet_sent(packet=packet)
 
+            # follow explicit pacing rates between ACKs
+            if (
+                self._cc.pacing_rate is not None
+                and self._cc.pacing_rate != self._pacing_rate
+            ):
+                self._update_pacing_rate()
+
             if self._quic_logger is not None:
                 self._log_metrics_updated()
 
+        if self._packet_trace is not None:
+            self._trace_packet(K_PACKET_TRACE_SENT, packet.sent_time, packet)
+
     def reschedule_data(self, *, now: float) -> None:
         """
         Schedule some data for retransmission.
@@ -366,6 +578,9 @@ class QuicPacketRecovery:
             if packet.is_ack_eliciting:
                 space.ack_eliciting_in_flight -= 1
 
+            if self._packet_trace is not None:
+                self._trace_packet(K_PACKET_TRACE_LOST, now, packet)
+
             if self._quic_logger is not None:
                 self._quic_logger.log_event(
                     category="recovery",
@@ -384,9 +599,23 @@ class QuicPacketRecovery:
         # inform congestion controller
         if lost_packets_cc:
             self._cc.on_packets_lost(now=now, packets=lost_packets_cc)
-            self._pacer.update_rate(
-                congestion_window=self._cc.congestion_window,
-                smoothed_rtt=self._rtt_smoothed,
-            )
+            self._update_pacing_rate()
             if self._quic_logger is not None:
                 self._log_metrics_updated()
+
+    def _update_pacing_rate(self) -> None:
+        self._pacing_rate = self._cc.pacing_rate
+        self._pacer.update_rate(
+            congestion_window=self._cc.congestion_window,
+            smoothed_rtt=self._rtt_smoothed,
+            pacing_rate=self._pacing_rate,
+        )
+
+    def _trace_packet(self, event: int, now: float, packet: QuicSentPacket) -> None:
+        self._packet_trace.record(
+            event=event,
+            now=now,
+            packet=packet,
+            congestion_window=self._cc.congestion_window,
+            bytes_in_flight=self._cc.bytes_in_flight,
+        )
@@ -0,0 +1,126 @@
+from unittest import TestCase, mock
+
+import numpy as np
+import pulse_replay
+import TimestampLogger
+from aioquic.quic.congestion.pulse import PulseCongestionControl
+
+SAMPLING_INTERVAL = 0.2
+
+
+def make_config(**cca):
+    return {
+        "cca": {
+            "name": "pulse",
+            "waveform": "sine",
+            "mod_rate": 1,
+            "cwnd_base_0": 1200,
+            "base_to_amplitude_ratio": 0.25,
+            "sampling_rate": 1 / SAMPLING_INTERVAL,
+            "initial_rtt": 0.1,
+            "transferred_metrics": [
+                "cwnd",
+                "acked_byte",
+                "sent_byte",
+                "rtt",
+                "lost_byte",
+                "cwnd_base",
+            ],
+            "phi": 0.05,
+            "increase_percentile": 25,
+            **cca,
+        },
+        "out": {"ui_out": False, "out_after": 60, "filename": "replay_test"},
+        "provider": {"single_file_mode": False},
+    }
+
+
+def make_trace():
+    # 10 Mbit/s halving to 5 Mbit/s after 40 s, 110 to 130 ms once measured
+    delta_t = np.arange(300) * SAMPLING_INTERVAL
+    capacity = np.where(delta_t < 40, 1.25e6, 0.625e6)
+    rtt = np.where(delta_t < 0.6, 0.1, 0.12 + 0.01 * np.sin(0.3 * delta_t))
+    return {
+        "delta_t": delta_t,
+        "acked_byte": capacity * SAMPLING_INTERVAL,
+        "rtt": rtt,
+    }
+
+
+def run_live(trace, config):
+    """
+    Step PULSE's own state machine through `trace` with the replay's open
+    loop path model.
+    """
+    clock = [0.0]
+    initial_rtt = config["cca"]["initial_rtt"]
+    states = []
+    bases = []
+    # no loop timers, the controller ticks are called in their order
+    with (
+        mock.patch("TickScheduler.get_scheduler"),
+        mock.patch.object(TimestampLogger.TimestampLogger, "save"),
+    ):
+        cc = PulseCongestionControl(
+            max_datagram_size=1200, external_config=config, clock=lambda: clock[0]
+        )
+        measured = False
+        for now, acked_raw, rtt in zip(
+            trace["delta_t"], trace["acked_byte"], trace["rtt"]
+        ):
+            clock[0] = now
+            measured = measured or rtt != initial_rtt
+            if measured:
+                cc.on_rtt_measurement(now=now, rtt=rtt)
+            cc.modulate_congestion_window()
+            acked = min(acked_raw, cc.congestion_window * SAMPLING_INTERVAL / rtt)
+            cc.acked_byte.add(acked, cc.rtt_estimate)
+            cc.on_rate_sample(now=now, delivery_rate=acked / SAMPLING_INTERVAL)
+            cc.control()
+            states.append(pulse_replay.STATE_NAMES.index(cc._operation_state.name))
+            bases.append(cc._base_cwnd)
+        cc.close()
+    return np.array(states), np.array(bases)
+
+
+class PulseReplayTest(TestCase):
+    def assertReplayMatchesLive(self, config):
+        trace = make_trace()
+        params = pulse_replay.parameter_grid(
+            [config["cca"]["phi"]],
+            [config["cca"]["increase_percentile"]],
+            [config["cca"]["base_to_amplitude_ratio"]],
+            [config["cca"]["waveform"]],
+        )
+        result = pulse_replay.replay(trace, params, config)
+        states, bases = run_live(trace, config)
+
+        # the run has to leave STATIC again for the comparison to cover it
+        self.assertGreater(np.count_nonzero(states == pulse_replay.CORRECT), 1)
+        self.assertEqual(result["states"][:, 0].tolist(), states.tolist())
+        np.testing.assert_allclose(result["bases"][:, 0], bases, rtol=1e-9)
+
+    def test_delivery_rate(self):
+        # longer than the analyzer window, the estimators part after the drop
+        self.assertReplayMatchesLive(
+            make_config(bdp_estimator="delivery_rate", bandwidth_window=4)
+        )
+
+    def test_acked_byte(self):
+        self.assertReplayMatchesLive(make_config(bdp_estimator="acked_byte"))
+
+    def test_unmodelled_options(self):
+        with self.assertRaises(ValueError) as cm:
+            pulse_replay.check_config(
+                make_config(response_analysis="spectral", loss_reaction=True)["cca"]
+            )
+        self.assertEqual(
+            str(cm.exception),
+            "Replay does not model response_analysis = 'spectral', "
+            "loss_reaction = True",
+        )
+
+    def test_unknown_bdp_estimator(self):
+        with self.assertRaises(ValueError) as cm:
+            pulse_replay.check_config(make_config(bdp_estimator="bogus")["cca"])
+        self.assertEqual(str(cm.exception), "Unknown bdp_estimator: bogus")
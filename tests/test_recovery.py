@@ -1,7 +1,32 @@
+import io
 from unittest import TestCase
 
 from aioquic.quic.congestion.base import QuicRttMonitor, create_congestion_control
-from aioquic.quic.recovery import QuicPacketPacer
+from aioquic.quic.packet_builder import QuicSentPacket
+from aioquic.quic.recovery import (
+    K_PACKET_TRACE_ACKED,
+    K_PACKET_TRACE_LOST,
+    K_PACKET_TRACE_SENT,
+    QuicDeliveryRateEstimator,
+    QuicPacketPacer,
+    QuicPacketTrace,
+)
+from aioquic.tls import Epoch
+
+
+def send_packet(estimator, packet_number, sent_time, bytes_in_flight):
+    packet = QuicSentPacket(
+        epoch=Epoch.ONE_RTT,
+        in_flight=True,
+        is_ack_eliciting=True,
+        is_crypto_packet=False,
+        packet_number=packet_number,
+        packet_type=0,
+        sent_time=sent_time,
+        sent_bytes=1000,
+    )
+    estimator.on_packet_sent(packet=packet, bytes_in_flight=bytes_in_flight)
+    return packet
 
 
 class QuicCongestionControlTest(TestCase):
@@ -13,6 +38,39 @@ class QuicCongestionControlTest(TestCase):
         )
 
 
+class QuicDeliveryRateEstimatorTest(TestCase):
+    def setUp(self):
+        self.estimator = QuicDeliveryRateEstimator()
+
+    def test_no_ack(self):
+        self.assertIsNone(self.estimator.generate_rate_sample(min_rtt=0.0))
+
+    def test_rate_sample(self):
+        # 10 packets sent back to back, acked one RTT later at 1 packet / ms
+        packets = [send_packet(self.estimator, i, 0.0, i * 1000) for i in range(10)]
+        for i, packet in enumerate(packets):
+            self.estimator.on_packet_acked(packet=packet, now=0.1 + i * 0.001)
+        self.assertAlmostEqual(
+            self.estimator.generate_rate_sample(min_rtt=0.1), 10000 / 0.109
+        )
+        self.assertEqual(self.estimator.delivered, 10000)
+
+        # the sample is consumed
+        self.assertIsNone(self.estimator.generate_rate_sample(min_rtt=0.1))
+
+        # next flight is clocked out by the acks
+        packet = send_packet(self.estimator, 10, 0.109, 0)
+        self.estimator.on_packet_acked(packet=packet, now=0.209)
+        self.assertAlmostEqual(
+            self.estimator.generate_rate_sample(min_rtt=0.05), 1000 / 0.1
+        )
+
+    def test_short_interval(self):
+        packet = send_packet(self.estimator, 0, 0.0, 0)
+        self.estimator.on_packet_acked(packet=packet, now=0.05)
+        self.assertIsNone(self.estimator.generate_rate_sample(min_rtt=0.1))
+
+
 class QuicPacketPacerTest(TestCase):
     def setUp(self):
         self.pacer = QuicPacketPacer(max_datagram_size=1280)
@@ -56,6 +114,83 @@ class QuicPacketPacerTest(TestCase):
             self.pacer.update_after_send(now=1.00015)
         self.assertAlmostEqual(self.pacer.next_send_time(now=1.00015), 1.0002)
 
+    def test_explicit_pacing_rate(self):
+        self.pacer.update_rate(
+            congestion_window=1280000, smoothed_rtt=0.05, pacing_rate=12800000
+        )
+        self.assertAlmostEqual(self.pacer.packet_time, 0.0001)
+        self.assertAlmostEqual(self.pacer.bucket_max, 0.0016)
+
+
+class QuicPacketTraceTest(TestCase):
+    def test_record(self):
+        trace = QuicPacketTrace(capacity=4)
+        packet = send_packet(QuicDeliveryRateEstimator(), 7, 0.5, 0)
+        trace.record(
+            event=K_PACKET_TRACE_SENT,
+            now=0.5,
+            packet=packet,
+            congestion_window=12000,
+            bytes_in_flight=1000,
+        )
+        trace.record(
+            event=K_PACKET_TRACE_ACKED,
+            now=0.6,
+            packet=packet,
+            congestion_window=13000,
+            bytes_in_flight=0,
+        )
+        self.assertEqual(len(trace), 2)
+        self.assertEqual(
+            list(QuicPacketTrace.parse(trace.to_bytes())),
+            [
+                (K_PACKET_TRACE_SENT, 3, 1000, 7, 0.5, 0.5, 12000, 1000),
+                (K_PACKET_TRACE_ACKED, 3, 1000, 7, 0.6, 0.5, 13000, 0),
+            ],
+        )
+
+    def test_ring(self):
+        trace = QuicPacketTrace(capacity=4)
+        estimator = QuicDeliveryRateEstimator()
+        for i in range(6):
+            trace.record(
+                event=K_PACKET_TRACE_SENT,
+                now=i,
+                packet=send_packet(estimator, i, i, 0),
+                congestion_window=12000,
+                bytes_in_flight=0,
+            )
+
+        # the two oldest records are overwritten
+        self.assertEqual(len(trace), 4)
+        self.assertEqual(
+            [record[3] for record in QuicPacketTrace.parse(trace.to_bytes())],
+            [2, 3, 4, 5],
+        )
+
+    def test_dump(self):
+        trace = QuicPacketTrace(capacity=4)
+        trace.record(
+            event=K_PACKET_TRACE_LOST,
+            now=1.0,
+            packet=send_packet(QuicDeliveryRateEstimator(), 1, 0.5, 0),
+            congestion_window=12000,
+            bytes_in_flight=0,
+        )
+
+        fp = io.BytesIO()
+        trace.dump(fp)
+        self.assertEqual(fp.getvalue(), trace.to_bytes())
+
+        with self.assertRaises(ValueError) as cm:
+            trace.dump()
+        self.assertEqual(str(cm.exception), "No file given and the trace has no path")
+
+    def test_zero_capacity(self):
+        with self.assertRaises(ValueError) as cm:
+            QuicPacketTrace(capacity=0)
+        self.assertEqual(str(cm.exception), "Packet trace capacity must be at least 1")
+
 
 class QuicRttMonitorTest(TestCase):
     def test_monitor(self):
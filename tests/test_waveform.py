@@ -0,0 +1,99 @@
+import math
+from unittest import TestCase, mock
+
+from aioquic.quic.congestion import waveform as waveform_module
+from aioquic.quic.congestion.waveform import (
+    QuicWaveform,
+    create_waveform,
+    register_waveform,
+)
+
+
+class QuicWaveformTest(TestCase):
+    def test_create_unknown_waveform(self):
+        with self.assertRaises(ValueError) as cm:
+            create_waveform("bogus", frequency=1)
+        self.assertEqual(str(cm.exception), "Unknown waveform: bogus")
+
+    # the registry is global, keep "constant" out of later tests
+    @mock.patch.dict(waveform_module._factories)
+    def test_register_waveform(self):
+        def constant(*, frequency, config):
+            return QuicWaveform(table=[config["level"]], frequency=frequency)
+
+        register_waveform("constant", constant)
+        waveform = create_waveform("constant", frequency=1, config={"level": 0.5})
+        self.assertEqual(waveform.sample(0.3), 0.5)
+
+    def test_builtin(self):
+        for t in [0.0, 0.1, 0.3, 0.6, 0.85, 1.7, 12.35]:
+            phase = (2 * t) % 1
+            expected = {
+                "sine": math.sin(2 * math.pi * phase),
+                "square": 1 if phase < 0.5 else -1,
+                "triangle": 4 * abs(phase - 0.5) - 1,
+                "saw": 2 * phase - 1,
+            }
+            for name, value in expected.items():
+                waveform = create_waveform(name, frequency=2)
+                self.assertAlmostEqual(waveform.sample(t), value, delta=0.01)
+
+    def test_phase_accumulator(self):
+        waveform = create_waveform("saw", frequency=1)
+        for i in range(1000):
+            waveform.sample(i * 0.2)
+        self.assertAlmostEqual(waveform.sample(200.1), -0.8, delta=0.01)
+
+        # frequency changes do not make the phase jump
+        waveform.frequency = 2
+        self.assertAlmostEqual(waveform.sample(200.2), -0.4, delta=0.01)
+
+    def test_chirp(self):
+        waveform = create_waveform(
+            "chirp",
+            frequency=1,
+            config={"chirp_start": 1, "chirp_end": 3, "chirp_periods": 2},
+        )
+        self.assertEqual(waveform.frequency, 0.5)
+
+        # 1 Hz at the start, 3 Hz at the end of the sweep
+        for t in [0.1, 0.25, 0.9, 1.5, 1.95, 2.1]:
+            sweep = t % 2
+            self.assertAlmostEqual(
+                waveform.sample(t),
+                math.sin(2 * math.pi * (sweep + sweep * sweep / 2)),
+                delta=0.05,
+            )
+
+    def test_multitone(self):
+        waveform = create_waveform(
+            "multitone", frequency=1, config={"tones": [1, 3], "tone_gains": [1, 1]}
+        )
+        self.assertAlmostEqual(max(waveform.table), 1)
+        self.assertAlmostEqual(waveform.sample(0.25), 0, delta=0.01)
+
+    def test_max_frequency(self):
+        self.assertEqual(create_waveform("sine", frequency=2).max_frequency, 2)
+        self.assertEqual(
+            create_waveform(
+                "multitone", frequency=2, config={"tones": [1, 3]}
+            ).max_frequency,
+            6,
+        )
+        self.assertEqual(
+            create_waveform(
+                "chirp", frequency=1, config={"chirp_start": 1, "chirp_end": 3}
+            ).max_frequency,
+            3,
+        )
+
+    def test_prbs(self):
+        waveform = create_waveform("prbs", frequency=1, config={"prbs_order": 5})
+        self.assertEqual(len(waveform.table), 31)
+        self.assertEqual(waveform.table.count(1.0), 16)
+        self.assertEqual(waveform.table.count(-1.0), 15)
+        self.assertEqual(waveform.frequency, 1 / 31)
+
+    def test_prbs_unsupported_order(self):
+        with self.assertRaises(ValueError):
+            create_waveform("prbs", frequency=1, config={"prbs_order": 32})
@@ -2,91 +2,277 @@ from collections import deque
 
 import numpy as np
 
+# fundamental gain of a sine clipped from above at c * amplitude,
+# g(c) = 1/2 + (asin(c) + c * sqrt(1 - c^2)) / pi, tabulated for inversion
+_CLIP_LEVELS = np.linspace(-1, 1, 201)
+_CLIP_GAINS = (
+    0.5
+    + (np.arcsin(_CLIP_LEVELS) + _CLIP_LEVELS * np.sqrt(1 - _CLIP_LEVELS**2)) / np.pi
+)
 
-class AnalyzerUnit:
 
+class WindowExtremum:
+    """
+    Sliding window minimum/maximum using a monotonic deque of (key, value)
+    pairs. Keys are sample sequence numbers or timestamps, entries older
+    than `window` keys are evicted on push.
+    """
+
+    def __init__(self, window, maximum=True):
+        self._window = window
+        self._maximum = maximum
+        self._queue = deque()
+
+    def push(self, seq, value):
+        queue = self._queue
+        if self._maximum:
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+        else:
+            while queue and queue[-1][1] >= value:
+                queue.pop()
+        queue.append((seq, value))
+        while queue[0][0] <= seq - self._window:
+            queue.popleft()
+
+    def get(self):
+        if not self._queue:
+            return None
+        return self._queue[0][1]
+
+    def clear(self):
+        self._queue.clear()
+
+
+class AnalyzerUnit:
     def __init__(
         self,
         config,
     ):
-        self.metrics = {
-            name: np.array([], dtype=float)
-            for name in config["cca"]["transferred_metrics"]
-        }
-        self.metrics["delta_t"] = np.array([], dtype=float)
         self._config = config
+        self._columns = ["delta_t"] + config["cca"]["transferred_metrics"]
+        self._column_index = {name: i for i, name in enumerate(self._columns)}
 
-        self._base_to_amplitude_ratio = float(
+        # the controller may retune the amplitude, see adaptive_amplitude
+        self.base_to_amplitude_ratio = float(
             config["cca"].get("base_to_amplitude_ratio", 1)
         )
         self._sampling_rate = float(config["cca"]["sampling_rate"])
         self._modulation_frequency = float(config["cca"].get("mod_rate", 1))
-        self.input_queue = deque(
-            maxlen=int(self._sampling_rate / self._modulation_frequency * 2)
+        self.window = int(self._sampling_rate / self._modulation_frequency * 2)
+        # share of the upper half amplitude the controller currently uses
+        self.upper_amplitude = 1.0
+
+        # "peak" compares the window maxima of cwnd and ACK response,
+        # "spectral" their amplitude at mod_rate
+        self.response_analysis = config["cca"].get("response_analysis", "peak")
+
+        # preallocated ring buffer, one row per sample
+        self._buffer = np.zeros((self.window, len(self._columns)), dtype=float)
+        self._head = 0
+        self._count = 0
+        self._seq = 0
+
+        self._rtt_min = WindowExtremum(self.window, maximum=False)
+        self._acked_max = WindowExtremum(self.window)
+        self._cwnd_max = WindowExtremum(self.window)
+        self._lost_sum = 0.0
+        self._sent_sum = 0.0
+
+        # sliding DFT bins at the probed frequencies, every sample keeps its
+        # phasors so they can be taken out again on eviction
+        tones = [1]
+        if config["cca"].get("waveform") == "multitone":
+            tones = config["cca"].get("tones", [1, 2])
+        self._tone_frequencies = np.array(tones, dtype=float) * (
+            self._modulation_frequency
         )
+        if np.any(self._tone_frequencies >= self._sampling_rate / 2):
+            raise ValueError(
+                f"Probe tones {tones} exceed the Nyquist frequency of "
+                f"sampling_rate {self._sampling_rate}"
+            )
+        self._omega = 2 * np.pi * self._tone_frequencies
+        self._phasors = np.zeros((self.window, len(tones)), dtype=complex)
+        self._phasor_sum = np.zeros(len(tones), dtype=complex)
+        self._cwnd_bin = np.zeros(len(tones), dtype=complex)
+        self._acked_bin = np.zeros(len(tones), dtype=complex)
+        self._acked_sum = 0.0
+        self.response_gain = None
+        self.response_phase = None
 
         self._rtt_estimate = 0.1
 
-        self.congwin_to_response_ratio = deque(
-            [0] * self.input_queue.maxlen, maxlen=self.input_queue.maxlen
-        )
-        self.loss_rate = deque(
-            [0] * self.input_queue.maxlen, maxlen=self.input_queue.maxlen
-        )
+        self.congwin_to_response_ratio = deque([0] * self.window, maxlen=self.window)
+        self.loss_rate = deque([0] * self.window, maxlen=self.window)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def seq(self):
+        """
+        Number of samples added so far, changes whenever new data arrived.
+        """
+        return self._seq
+
+    @property
+    def metrics(self):
+        """
+        Chronologically ordered copy of the window, one array per metric.
+        """
+        if self._count < self.window:
+            arr = self._buffer[: self._count].copy()
+        else:
+            arr = np.roll(self._buffer, -self._head, axis=0)
+        return {name: arr[:, i] for i, name in enumerate(self._columns)}
 
     def update_processing(self):
-        if len(self.input_queue) == 0:
+        if self._count == 0:
             return
-        arr = np.array(self.input_queue)
-        self.metrics = {
-            name: arr[:, i]
-            for i, name in enumerate(
-                ["delta_t"] + self._config["cca"]["transferred_metrics"]
-            )
-        }
 
-        self._update_rtt(self.metrics["rtt"])
+        self._rtt_estimate = self._rtt_min.get()
         self._generate_congwin_to_response_ratio()
         self._generate_loss_rate()
 
     def add_to_queue(self, entry):
-        self.input_queue.append(entry)
+        row = self._buffer[self._head]
+        if self._count == self.window:
+            self._evict(row)
+        else:
+            self._count += 1
+        row[:] = entry
+
+        seq = self._seq
+        self._rtt_min.push(seq, self._value(row, "rtt"))
+        self._acked_max.push(seq, self._value(row, "acked_byte"))
+        self._cwnd_max.push(seq, self._value(row, "cwnd"))
+        self._lost_sum += self._value(row, "lost_byte")
+        self._sent_sum += self._value(row, "sent_byte")
+
+        phasor = np.exp(-1j * self._omega * self._value(row, "delta_t"))
+        self._phasors[self._head] = phasor
+        self._phasor_sum += phasor
+        self._cwnd_bin += self._excitation(row) * phasor
+        self._acked_bin += self._response(row) * phasor
+        self._acked_sum += self._response(row)
+
+        self._seq += 1
+        self._head = (self._head + 1) % self.window
+        if self._head == 0:
+            # resync the running sums once per lap to bound float drift
+            self._lost_sum = float(np.sum(self._column("lost_byte")))
+            self._sent_sum = float(np.sum(self._column("sent_byte")))
+            excitation = np.array([self._excitation(row) for row in self._buffer])
+            response = np.array([self._response(row) for row in self._buffer])
+            self._phasor_sum = np.sum(self._phasors, axis=0)
+            self._cwnd_bin = excitation @ self._phasors
+            self._acked_bin = response @ self._phasors
+            self._acked_sum = float(np.sum(response))
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        for extremum in (self._rtt_min, self._acked_max, self._cwnd_max):
+            extremum.clear()
+        self._lost_sum = 0.0
+        self._sent_sum = 0.0
+        self._phasor_sum[:] = 0
+        self._cwnd_bin[:] = 0
+        self._acked_bin[:] = 0
+        self._acked_sum = 0.0
+        self.response_gain = None
+        self.response_phase = None
 
     def get_rtt_estimate(self):
-        if len(self.metrics["rtt"]) != 0:
-            return np.min(self.metrics["rtt"])
+        if self._count != 0:
+            return self._rtt_min.get()
         else:
             return 0.5  # fallback, should be more robust
 
     def get_bdp_estimate(self):
-        if len(self.metrics["acked_byte"]) == 0:
-            return
-        return np.max(self.metrics["acked_byte"])
+        return self._acked_max.get()
+
+    def _value(self, row, name, default=0.0):
+        i = self._column_index.get(name)
+        if i is None:
+            return default
+        return row[i]
+
+    def _column(self, name):
+        i = self._column_index.get(name)
+        if i is None:
+            return np.zeros(0)
+        return self._buffer[: self._count, i]
+
+    def _evict(self, row):
+        self._lost_sum -= self._value(row, "lost_byte")
+        self._sent_sum -= self._value(row, "sent_byte")
+        phasor = self._phasors[self._head]
+        self._phasor_sum -= phasor
+        self._cwnd_bin -= self._excitation(row) * phasor
+        self._acked_bin -= self._response(row) * phasor
+        self._acked_sum -= self._response(row)
+
+    # both signals are normalised by the base of their sample, otherwise
+    # the exponential growth in INCREASE leaks into the bin
+    def _base(self, row):
+        base = self._value(row, "cwnd_base", 1.0)
+        return base if base > 0 else 1.0
+
+    def _excitation(self, row):
+        return self._value(row, "cwnd") / self._base(row) - 1
+
+    def _response(self, row):
+        return self._value(row, "acked_byte") / self._base(row)
+
+    def _latest(self, name, default):
+        return self._value(self._buffer[self._head - 1], name, default)
 
     def _generate_congwin_to_response_ratio(self):
-        if (
-            self.metrics["cwnd"] is None
-            or len(self.metrics["cwnd"]) == 0
-            or self.metrics["acked_byte"] is None
-            or len(self.metrics["acked_byte"]) == 0
-            or self.metrics.get("cwnd_base", [1])[-1] is None
-            or max(self.metrics["acked_byte"]) == 0
-        ):
+        if self.response_analysis == "spectral":
+            self._generate_spectral_ratio()
+            return
+
+        cwnd_max = self._cwnd_max.get()
+        acked_max = self._acked_max.get()
+        if cwnd_max is None or acked_max is None or acked_max == 0:
             self.congwin_to_response_ratio.append(0.5)
             return
 
         self.congwin_to_response_ratio.append(
-            (max(self.metrics["cwnd"]) - max(self.metrics["acked_byte"]))
+            (cwnd_max - acked_max)
             / (
                 2
-                * self.metrics.get("cwnd_base", [1])[-1]
-                * self._base_to_amplitude_ratio
+                * self._latest("cwnd_base", 1)
+                * self.base_to_amplitude_ratio
+                * self.upper_amplitude
             )
         )
 
+    def _generate_spectral_ratio(self):
+        # an unsaturated path passes the modulation through (gain 1), a
+        # saturated one clips the ACK response at the BDP; the gain is mapped
+        # back to that clip level so the ratio reads like the peak ratio
+        excitation = np.abs(self._cwnd_bin)
+        if self._count < self.window or np.sum(excitation) < 1e-9:
+            self.congwin_to_response_ratio.append(0.5)
+            return
+
+        # remove the mean of the response, the samples need not be evenly
+        # spaced over whole periods
+        response = self._acked_bin - self._acked_sum / self._count * self._phasor_sum
+        # acked_byte is summed over the sampling interval, undo the boxcar
+        response /= np.sinc(self._tone_frequencies / self._sampling_rate)
+        ratio = response / np.where(excitation > 0, self._cwnd_bin, 1)
+        self.response_gain = np.abs(ratio)
+        self.response_phase = -np.angle(ratio)
+
+        # tones are weighted by how strongly they are excited
+        gain = np.sum(np.abs(response)) / np.sum(excitation)
+        clip_level = np.interp(gain, _CLIP_GAINS, _CLIP_LEVELS)
+        self.congwin_to_response_ratio.append((1 - clip_level) / 2)
+
     def _generate_loss_rate(self):
-        rate = sum(self.metrics["lost_byte"], 0) / sum(self.metrics["sent_byte"], 1)
+        rate = max(self._lost_sum, 0) / (1 + max(self._sent_sum, 0))
         self.loss_rate.append(rate)
-
-    def _update_rtt(self, latest_rtt):
-        self._rtt_estimate = np.min(latest_rtt)
@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+
+"""
+    Bounded columnar store for the logger samples.
+    One preallocated float array per store, a column per metric. When it is
+    full, the rows are either handed to a `sink`, spilled to disk as a .npy
+    chunk or the oldest rows are overwritten, so memory per connection stays
+    at `capacity` rows.
+"""
+
+
+class LogStore:
+    def __init__(self, columns, capacity, spill_prefix=None, sink=None):
+        self.columns = list(columns)
+        self._column_index = {name: i for i, name in enumerate(self.columns)}
+        self.capacity = capacity
+        self._spill_prefix = spill_prefix
+        self._sink = sink
+
+        self._buffer = np.zeros((capacity, len(self.columns)), dtype=float)
+        self._head = 0
+        self._count = 0
+        self._chunks = []
+        # rows overwritten without spilling
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count + self.capacity * len(self._chunks)
+
+    def append(self, row):
+        if self._count == self.capacity:
+            if self._sink is not None:
+                self.flush()
+            elif self._spill_prefix is not None:
+                self._spill()
+            else:
+                self.dropped += 1
+        self._buffer[self._head] = row
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def column(self, name):
+        """
+        Chronologically ordered copy of the rows held in memory for `name`.
+        """
+        return self.rows()[:, self._column_index[name]]
+
+    def rows(self):
+        """
+        Chronologically ordered copy of the rows held in memory.
+        """
+        if self._count < self.capacity:
+            return self._buffer[: self._count].copy()
+        return np.roll(self._buffer, -self._head, axis=0)
+
+    def chunks(self):
+        """
+        Yield all rows in order, spilled chunks first, one array per chunk.
+        """
+        for filename in self._chunks:
+            yield np.load(filename)
+        if self._count:
+            yield self.rows()
+
+    def flush(self):
+        """
+        Hand the rows held in memory to the sink.
+        """
+        if self._count == 0:
+            return
+        if self._count == self.capacity and self._head == 0:
+            # the sink owns the full buffer from now on, no copy
+            self._sink(self._buffer)
+            self._buffer = np.zeros_like(self._buffer)
+        else:
+            self._sink(self.rows())
+        self._head = 0
+        self._count = 0
+
+    def clear(self):
+        for filename in self._chunks:
+            os.remove(filename)
+        self._chunks = []
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+
+    def _spill(self):
+        # the buffer is full and _head has wrapped to 0, rows are in order
+        directory = os.path.dirname(self._spill_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        filename = f"{self._spill_prefix}_chunk{len(self._chunks):04d}.npy"
+        np.save(filename, self._buffer)
+        self._chunks.append(filename)
+        self._head = 0
+        self._count = 0
@@ -0,0 +1,97 @@
+"""
+Typed metrics sampled by the TimestampLogger and the controllers.
+Gauges are read when sampling and land unchanged in the scaled and the
+raw row. Counters only ever grow, the congestion control adds to them on
+every packet event. Every MetricSampler keeps its own snapshot of them,
+so consumers at different rates each get the bytes of their own interval:
+the raw row holds the plain sum, the scaled row the weighted sum divided
+by the sampler's interval.
+"""
+
+
+class Counter:
+    __slots__ = ("weighted", "raw")
+
+    def __init__(self):
+        self.weighted = 0.0
+        self.raw = 0.0
+
+    def add(self, value, weight=1.0):
+        self.weighted += value * weight
+        self.raw += value
+
+
+class Gauge:
+    __slots__ = ("read", "cleanup")
+
+    def __init__(self, read, cleanup=None):
+        self.read = read
+        self.cleanup = cleanup
+
+
+class MetricSampler:
+    def __init__(self, gauges, counters, interval):
+        self._gauges = gauges
+        self._counters = counters
+        self.interval = interval
+        self._weighted = [counter.weighted for _, counter in counters]
+        self._raw = [counter.raw for _, counter in counters]
+
+    def sample(self, scaled_row, raw_row):
+        for i, gauge in self._gauges:
+            scaled_row[i] = raw_row[i] = gauge.read()
+            if gauge.cleanup is not None:
+                gauge.cleanup()
+        weighted = self._weighted
+        raw = self._raw
+        for k, (i, counter) in enumerate(self._counters):
+            scaled_row[i] = (counter.weighted - weighted[k]) / self.interval
+            raw_row[i] = counter.raw - raw[k]
+            weighted[k] = counter.weighted
+            raw[k] = counter.raw
+
+
+class MetricRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def _register(self, name, metric):
+        if name in self._metrics:
+            raise KeyError(f"metric {name} is already registerered")
+        self._metrics[name] = metric
+        print("Metric Registered: ", name)
+        return metric
+
+    def register_gauge(self, name, read, cleanup=None):
+        return self._register(name, Gauge(read, cleanup))
+
+    def register_counter(self, name):
+        return self._register(name, Counter())
+
+    def get(self, name):
+        if name not in self._metrics:
+            raise KeyError(f"metric {name} was not registered.")
+        metric = self._metrics[name]
+        if isinstance(metric, Counter):
+            return metric.raw
+        return metric.read()
+
+    def sampler(self, columns, interval):
+        """
+        Resolve `columns` to row indices once, the first column being the
+        timestamp, for a consumer sampling every `interval` seconds.
+        """
+        gauges = []
+        counters = []
+        for i, name in enumerate(columns[1:], start=1):
+            if name not in self._metrics:
+                raise KeyError(f"metric {name} was not registered.")
+            metric = self._metrics[name]
+            if isinstance(metric, Counter):
+                counters.append((i, metric))
+            else:
+                gauges.append((i, metric))
+        return MetricSampler(gauges, counters, interval)
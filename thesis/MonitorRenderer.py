@@ -0,0 +1,140 @@
+import numpy as np
+
+"""
+    Blitting renderer for live_monitor.py.
+    The lines are animated artists drawn over a cached background of axes,
+    ticks and legends, so a frame only redraws the lines. The full figure is
+    redrawn when data leaves the axis limits (or uses less than `shrink` of
+    them), which happens rarely once a run has settled.
+    Series longer than the axis is wide are decimated to the minimum and
+    maximum sample of every pixel column.
+"""
+
+
+def decimate(x, y, columns):
+    """
+    Keep the minimum and maximum sample of each of `columns` equally wide
+    bins of ascending `x`, in their original order. Peaks survive, the
+    number of points is at most 2 * columns.
+    """
+    n = len(x)
+    if columns < 1 or n <= 2 * columns:
+        return x, y
+    span = x[-1] - x[0]
+    if span <= 0:
+        return x, y
+
+    bins = np.minimum(((x - x[0]) * (columns / span)).astype(int), columns - 1)
+    # within a bin the smallest value comes first, the largest last
+    order = np.lexsort((y, bins))
+    sorted_bins = bins[order]
+    first = np.flatnonzero(np.r_[True, sorted_bins[1:] != sorted_bins[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    keep = np.union1d(order[first], order[last])
+    return x[keep], y[keep]
+
+
+class BlitRenderer:
+    def __init__(self, fig, headroom=0.1, shrink=0.5):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.headroom = headroom
+        self.shrink = shrink
+        self._lines = []
+        # axis -> (scale x, scale y), limits set before add_line stay fixed
+        self._scaled = {}
+        self._background = None
+        self.frames = 0
+        self.full_draws = 0
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def add_line(self, line):
+        line.set_animated(True)
+        self._lines.append(line)
+        ax = line.axes
+        if ax not in self._scaled:
+            self._scaled[ax] = (ax.get_autoscalex_on(), ax.get_autoscaley_on())
+        # new artists are only part of a full draw
+        self._background = None
+
+    def remove_line(self, line):
+        self._lines.remove(line)
+        line.remove()
+        self._background = None
+
+    def set_data(self, line, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        line.set_data(*decimate(x, y, int(line.axes.bbox.width)))
+
+    def render(self):
+        """
+        Draw the current line data, blitting unless the limits changed.
+        """
+        self.frames += 1
+        if self.rescale() or self._background is None:
+            # _on_draw caches the new background and draws the lines
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_lines()
+            self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+    def savefig(self, *args, **kwargs):
+        """
+        Figure.savefig skips animated artists, include the lines for it.
+        """
+        for line in self._lines:
+            line.set_animated(False)
+        try:
+            self.fig.savefig(*args, **kwargs)
+        finally:
+            for line in self._lines:
+                line.set_animated(True)
+            # the draw for the file cached a background including the lines
+            self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        self.full_draws += 1
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_lines()
+
+    def _draw_lines(self):
+        for line in self._lines:
+            line.axes.draw_artist(line)
+
+    def rescale(self):
+        """
+        Fit the managed axis limits to the line data, True when they changed.
+        render() does this itself, call it before savefig when not rendering.
+        """
+        changed = False
+        for ax, (scalex, scaley) in self._scaled.items():
+            data = [line.get_xydata() for line in self._lines if line.axes is ax]
+            data = np.concatenate([d for d in data if len(d)] or [np.zeros((0, 2))])
+            if len(data) == 0:
+                continue
+            if scalex:
+                changed |= self._fit(ax.get_xlim, ax.set_xlim, data[:, 0])
+            if scaley:
+                changed |= self._fit(ax.get_ylim, ax.set_ylim, data[:, 1])
+        return changed
+
+    def _fit(self, get_limits, set_limits, values):
+        low = np.nanmin(values)
+        high = np.nanmax(values)
+        if not np.isfinite(low) or not np.isfinite(high):
+            return False
+        # constant series get a band of 0.1% of their magnitude
+        spread = max(high - low, 1e-3 * max(abs(low), abs(high), 1))
+        padding = spread * self.headroom
+        current_low, current_high = get_limits()
+        if (
+            low >= current_low
+            and high <= current_high
+            and high - low + 2 * padding >= self.shrink * (current_high - current_low)
+        ):
+            return False
+        set_limits(low - padding, high + padding)
+        return True
@@ -44,7 +44,8 @@ class QuicClient:
                     print("[client] Provider stopped data stream, closing stream.")
                     writer.write_eof()
                     break
-                streams[stream_selected].write(data.encode())
+                # bytes-like from the provider, written without a copy
+                streams[stream_selected].write(data)
                 await streams[stream_selected].drain()
                 stream_selected = (
                     0 if stream_selected == N_STREAMS - 1 else stream_selected + 1
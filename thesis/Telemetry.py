@@ -0,0 +1,114 @@
+import struct
+
+import numpy as np
+import zmq
+
+"""
+    Telemetry from the logger to live_monitor.py.
+    Samples are batched into one message of packed float64 rows and sent
+    without blocking; when the monitor is absent or slow the batch is
+    dropped and counted, the transport never waits on it.
+    Every message carries the flow it belongs to, so one monitor can follow
+    several connections, and the wall clock time the flow's delta_t counts
+    from, so their samples can be lined up.
+
+    Message layout, little endian:
+        header  b"PTLM", uint16 column count, uint16 row count,
+                float64 origin (unix time of delta_t = 0),
+                uint16 flow id length + utf-8 flow id
+        rows    row count * column count float64, row after row
+"""
+
+TELEMETRY_MAGIC = b"PTLM"
+TELEMETRY_HEADER = struct.Struct("<4sHHdH")
+# how long close() lets the queued batches drain, in milliseconds
+TELEMETRY_LINGER = 100
+
+
+def encode(rows, flow="", origin=0.0):
+    rows = np.asarray(rows, dtype="<f8")
+    flow = flow.encode()
+    return (
+        TELEMETRY_HEADER.pack(
+            TELEMETRY_MAGIC, rows.shape[1], rows.shape[0], origin, len(flow)
+        )
+        + flow
+        + rows.tobytes()
+    )
+
+
+def decode(message):
+    """
+    Return the flow id, its origin and the samples of a message as a
+    (rows, columns) array.
+    """
+    magic, column_count, row_count, origin, flow_length = TELEMETRY_HEADER.unpack_from(
+        message
+    )
+    if magic != TELEMETRY_MAGIC:
+        raise ValueError("Not a telemetry message")
+    offset = TELEMETRY_HEADER.size
+    flow = bytes(message[offset : offset + flow_length]).decode()
+    values = np.frombuffer(
+        message,
+        dtype="<f8",
+        count=row_count * column_count,
+        offset=offset + flow_length,
+    )
+    return flow, origin, values.reshape(row_count, column_count)
+
+
+class TelemetryPublisher:
+    def __init__(
+        self,
+        column_count,
+        batch_size=5,
+        hwm=100,
+        address="tcp://127.0.0.1:5555",
+        flow="",
+        origin=0.0,
+    ):
+        self.socket = zmq.Context.instance().socket(zmq.PUSH)
+        # queued batches before dropping, and no queueing for a monitor that
+        # is not connected (yet)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.connect(address)
+        self.flow = flow
+        self.origin = origin
+
+        self._batch = np.zeros((batch_size, column_count), dtype="<f8")
+        self._count = 0
+        self.sent_samples = 0
+        self.dropped_samples = 0
+        self.dropped_batches = 0
+
+    def publish(self, sample):
+        self._batch[self._count] = sample
+        self._count += 1
+        if self._count == len(self._batch):
+            self.flush()
+
+    def flush(self):
+        if self._count == 0:
+            return
+        try:
+            self.socket.send(
+                encode(self._batch[: self._count], self.flow, self.origin),
+                flags=zmq.NOBLOCK,
+            )
+            self.sent_samples += self._count
+        except zmq.Again:
+            self.dropped_samples += self._count
+            self.dropped_batches += 1
+        self._count = 0
+
+    def close(self):
+        self.flush()
+        # bounded, a monitor that went away must not hold up the exit
+        self.socket.close(linger=TELEMETRY_LINGER)
+        if self.dropped_samples:
+            print(
+                f"Telemetry: {self.sent_samples} samples sent, "
+                f"{self.dropped_samples} dropped in {self.dropped_batches} batches"
+            )
@@ -0,0 +1,103 @@
+import asyncio
+
+"""
+    Process-wide periodic tick scheduler.
+    All callbacks sharing a sampling interval are driven by one loop timer,
+    instead of every connection spawning its own sleeping coroutines.
+"""
+
+
+class TickHandle:
+    def __init__(self, wheel, callback):
+        self._wheel = wheel
+        self._callback = callback
+
+    def cancel(self):
+        if self._wheel is not None:
+            self._wheel.remove(self._callback)
+            self._wheel = None
+
+    def cancelled(self):
+        return self._wheel is None
+
+
+class TimerWheel:
+    def __init__(self, scheduler, loop, interval):
+        self._scheduler = scheduler
+        self._loop = loop
+        self.interval = interval
+        self.callbacks = {}
+        self._deadline = loop.time()
+        self._timer = loop.call_soon(self._tick)
+
+    def add(self, callback):
+        if callback in self.callbacks:
+            raise KeyError(f"callback {callback} is already registered")
+        self.callbacks[callback] = None
+
+    def remove(self, callback):
+        self.callbacks.pop(callback, None)
+        if not self.callbacks:
+            self.close()
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._scheduler.discard(self)
+
+    def _tick(self):
+        # iterate over a copy, callbacks may deregister while ticking
+        for callback in list(self.callbacks):
+            try:
+                callback()
+            except Exception as exc:
+                print("TICK FAILED:", callback, "EXCEPTION:", repr(exc))
+                self.callbacks.pop(callback, None)
+
+        if not self.callbacks:
+            self.close()
+            return
+
+        # fixed-rate ticks, skip the ones we are already late for
+        self._deadline += self.interval
+        now = self._loop.time()
+        if self._deadline < now:
+            self._deadline = now
+        self._timer = self._loop.call_at(self._deadline, self._tick)
+
+
+class TickScheduler:
+    def __init__(self):
+        self._wheels = {}
+
+    def register(self, interval, callback, loop=None):
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        key = (loop, interval)
+        wheel = self._wheels.get(key)
+        if wheel is None:
+            wheel = TimerWheel(self, loop, interval)
+            self._wheels[key] = wheel
+        wheel.add(callback)
+        return TickHandle(wheel, callback)
+
+    def discard(self, wheel):
+        key = (wheel._loop, wheel.interval)
+        if self._wheels.get(key) is wheel:
+            del self._wheels[key]
+
+    def active_callbacks(self):
+        return sum(len(wheel.callbacks) for wheel in self._wheels.values())
+
+
+_scheduler = TickScheduler()
+
+
+def loop_clock():
+    # the connection's notion of time, i.e. the `now` handed to the controllers
+    return asyncio.get_running_loop().time
+
+
+def get_scheduler():
+    return _scheduler
@@ -1,112 +1,190 @@
-import asyncio
 import csv
+import itertools
 import os
 import time
 
-import zmq
+import numpy as np
+import TickScheduler
+from LogStore import LogStore
+from MetricRegistry import MetricRegistry
+from Telemetry import TelemetryPublisher
+from TraceWriter import TraceWriter
+
+# numbers the loggers of a process for their default flow id
+_flow_counter = itertools.count()
 
 
 class TimestampLogger:
-    def __init__(self, ui_out, external_config, algo_instance):
-        self.RAW_LOG = []
-        self.SCALED_LOG = []
+    def __init__(self, ui_out, external_config, algo_instance, clock=None):
         self.ui_out = ui_out
         if ui_out:
-            self.socket = zmq.Context().socket(zmq.PUSH)
-            self.socket.connect("tcp://127.0.0.1:5555")
-        self.sampling_rate = external_config["cca"]["sampling_rate"]
-        self.registry = {}
-        self._start_time = time.monotonic()
-        self.direct_out = None
+            self.telemetry = TelemetryPublisher(
+                1 + len(external_config["cca"]["transferred_metrics"]),
+                batch_size=int(external_config["out"].get("telemetry_batch", 5)),
+                hwm=int(external_config["out"].get("telemetry_hwm", 100)),
+                # tells the monitor the connections of parallel runs apart
+                flow=external_config["out"].get(
+                    "flow_id",
+                    f"{external_config['cca']['name']}:{os.getpid()}"
+                    f":{next(_flow_counter)}",
+                ),
+                origin=time.time(),
+            )
+        # the logger may sample faster than the controller ticks, the
+        # counters give every consumer the bytes of its own interval
+        self.sampling_rate = float(
+            external_config["out"].get(
+                "log_rate", external_config["cca"]["sampling_rate"]
+            )
+        )
+        self.registry = MetricRegistry()
+        self._clock = clock if clock is not None else TickScheduler.loop_clock()
+        self._start_time = self._clock()
         self.saved = False
         self.csv_length = external_config["out"]["out_after"]
         self.csv_name = external_config["out"]["filename"]
+        self.filename_base = (
+            f"../data_out/{external_config['cca']['name']}/{self.csv_name}"
+        )
+        columns = ["delta_t"] + external_config["cca"]["transferred_metrics"]
+        self.columns = columns
+        # reused every tick, the consumers copy the rows
+        self._scaled_row = np.zeros(len(columns))
+        self._raw_row = np.zeros(len(columns))
+        # "csv" dumps the logs once, "trace" streams them to binary traces
+        # for the whole connection, see trace_export.py
+        self.log_writer = external_config["out"].get("log_writer", "csv")
+        if self.log_writer == "trace":
+            os.makedirs(os.path.dirname(self.filename_base), exist_ok=True)
+            self._trace_writers = [
+                TraceWriter(self.filename_base + "_raw.trace", columns),
+                TraceWriter(self.filename_base + "_scaled.trace", columns),
+            ]
+            # rows lost on a crash at most
+            chunk_rows = int(external_config["out"].get("trace_chunk_rows", 64))
+            self.RAW_LOG = LogStore(
+                columns, chunk_rows, sink=self._trace_writers[0].write
+            )
+            self.SCALED_LOG = LogStore(
+                columns, chunk_rows, sink=self._trace_writers[1].write
+            )
+        else:
+            # fixed number of rows held in memory per log, the rest is either
+            # spilled to .npy chunks next to the csv or overwritten
+            capacity = int(external_config["out"].get("log_capacity", 4096))
+            spill = external_config["out"].get("log_spill", False)
+            self.RAW_LOG = LogStore(
+                columns, capacity, self.filename_base + "_raw" if spill else None
+            )
+            self.SCALED_LOG = LogStore(
+                columns, capacity, self.filename_base + "_scaled" if spill else None
+            )
         self.single_file_mode = external_config["provider"]["single_file_mode"]
+        if self.single_file_mode:
+            # the transfer is over once nothing is acked for a controller tick
+            self._acked_index = columns.index("acked_byte")
+            self._idle_samples = 0
+            self._idle_limit = max(
+                1,
+                round(
+                    self.sampling_rate / float(external_config["cca"]["sampling_rate"])
+                ),
+            )
         self.external_config = external_config
         self.threshold = 0
         self.algo_instance = algo_instance
+        self._tick = None
 
     def register_metric(self, name: str, func, cleanup_function=None):
-        if name in self.registry:
-            raise KeyError(f"metric {name} is already registerered")
-        self.registry[name] = (func, cleanup_function)
-        print("Metric Registered: ", name)
+        """
+        Register a gauge, read once per sample.
+        """
+        self.registry.register_gauge(name, func, cleanup_function)
+
+    def register_counter(self, name: str):
+        """
+        Register a counter, the congestion control adds to the returned slots.
+        """
+        return self.registry.register_counter(name)
 
     def get_metric(self, name):
-        if name not in self.registry:
-            raise KeyError(f"metric {name} was not registered.")
-        callback, _ = self.registry[name]
-        return callback()
-
-    def run_metric_cleanup(self, name):
-        if name not in self.registry:
-            raise KeyError(f"metric {name} was not registered.")
-        _, cleanup = self.registry[name]
-        if cleanup is None:
-            return
-        cleanup()
+        return self.registry.get(name)
+
+    def start(self):
+        self._sampler = self.registry.sampler(self.columns, 1 / self.sampling_rate)
+        self._tick = TickScheduler.get_scheduler().register(
+            1 / self.sampling_rate, self.pass_timestamps
+        )
 
-    def set_direct_out(self, direct_out):
-        self.direct_out = direct_out
+    def stop(self):
+        if self._tick is not None:
+            self._tick.cancel()
+            self._tick = None
+        if not self.saved or self.log_writer == "trace":
+            self.save()
+        if self.log_writer == "trace":
+            for writer in self._trace_writers:
+                writer.close()
+        if self.ui_out:
+            self.telemetry.close()
+            self.ui_out = False
 
-    def save_to_csv(self, filename, data, header=None):
+    def save_to_csv(self, filename, store):
         directory = os.path.dirname(filename)
         if directory:
             os.makedirs(directory, exist_ok=True)
 
         with open(filename + ".csv", mode="w", newline="") as f:
             writer = csv.writer(f)
-            if header:
-                writer.writerow(header)
-            writer.writerows(data)
+            writer.writerow(store.columns)
+            for chunk in store.chunks():
+                writer.writerows(chunk.tolist())
+        if store.dropped:
+            print(f"Log capacity exceeded, {store.dropped} oldest rows dropped")
         print(f"Output written to: {filename}")
 
-    async def pass_timestamps(self):
-        while True:
-            delta_t = time.monotonic() - self._start_time
-            if delta_t > self.threshold:
-                print("----Running for", self.threshold, "s----", flush=True)
-                self.threshold += 10
+    def save(self):
+        if self.log_writer == "trace":
+            # the writer threads do the disk I/O, logging goes on
+            self.RAW_LOG.flush()
+            self.SCALED_LOG.flush()
+            if not self.saved:
+                print(f"Trace written to: {self.filename_base}")
+            self.saved = True
+            return
+        self.save_to_csv(self.filename_base + "_raw", self.RAW_LOG)
+        self.save_to_csv(self.filename_base + "_scaled", self.SCALED_LOG)
+        # the logs are only kept until they are written
+        self.RAW_LOG.clear()
+        self.SCALED_LOG.clear()
+        self.saved = True
 
-            timestamp_scaled = [delta_t]
-            timestamp_raw = [delta_t]
-            for name in self.external_config["cca"]["transferred_metrics"]:
-                timestamp_scaled.append(self.get_metric(name))
-                timestamp_raw.append(self.get_metric(name))
+    def pass_timestamps(self):
+        delta_t = self._clock() - self._start_time
+        if delta_t > self.threshold:
+            print("----Running for", self.threshold, "s----", flush=True)
+            self.threshold += 10
 
-            if self.ui_out:
-                self.socket.send_json(timestamp_scaled)
-            if self.direct_out is not None:
-                self.direct_out(timestamp_scaled)
+        timestamp_scaled = self._scaled_row
+        timestamp_raw = self._raw_row
+        timestamp_scaled[0] = timestamp_raw[0] = delta_t
+        self._sampler.sample(timestamp_scaled, timestamp_raw)
 
-            self.SCALED_LOG.append(timestamp_scaled)
+        if self.ui_out:
+            self.telemetry.publish(timestamp_scaled)
 
-            # edit timestamp for raw data
-            timestamp_raw[2] = self.algo_instance.get_acked_byte_raw()
-            timestamp_raw[3] = self.algo_instance.get_sent_byte_raw()
-            timestamp_raw[5] = self.algo_instance.get_lost_byte_raw()
+        if not self.saved or self.log_writer == "trace":
+            self.SCALED_LOG.append(timestamp_scaled)
             self.RAW_LOG.append(timestamp_raw)
-            if (
-                not self.single_file_mode
-                and (delta_t > self.csv_length)
-                or self.single_file_mode
-                and (delta_t > 10 and self.get_metric("acked_byte") == 0)
-            ) and not self.saved:
-                filename_base = (
-                    f"../data_out/{self.external_config['cca']['name']}/{self.csv_name}"
-                )
-                self.save_to_csv(
-                    filename_base + "_raw",
-                    self.RAW_LOG,
-                    ["delta_t"] + self.external_config["cca"]["transferred_metrics"],
-                )
-                self.save_to_csv(
-                    filename_base + "_scaled",
-                    self.SCALED_LOG,
-                    ["delta_t"] + self.external_config["cca"]["transferred_metrics"],
-                )
-                self.saved = True
-            for name in self.external_config["cca"]["transferred_metrics"]:
-                self.run_metric_cleanup(name)
-
-            await asyncio.sleep(1 / self.sampling_rate)
+        if self.single_file_mode:
+            if timestamp_raw[self._acked_index] == 0:
+                self._idle_samples += 1
+            else:
+                self._idle_samples = 0
+        if (
+            not self.single_file_mode
+            and (delta_t > self.csv_length)
+            or self.single_file_mode
+            and (delta_t > 10 and self._idle_samples >= self._idle_limit)
+        ) and not self.saved:
+            self.save()
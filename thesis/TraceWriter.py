@@ -0,0 +1,105 @@
+import queue
+import struct
+import threading
+
+import numpy as np
+
+"""
+    Incremental binary trace of the logger samples.
+    Chunks of rows are handed to a background thread, which appends them to
+    the file and flushes, so the event loop never waits on disk and a crash
+    loses at most the chunk that was still being filled.
+
+    Layout, little endian:
+        header  b"PTRC", uint16 version, uint16 column count,
+                per column uint16 name length + utf-8 name
+        chunk   uint32 row count, then every column as float64 row count
+                values, one column after the other
+"""
+
+TRACE_MAGIC = b"PTRC"
+TRACE_VERSION = 1
+
+
+class TraceWriter:
+    def __init__(self, filename, columns):
+        self.filename = filename
+        self.columns = list(columns)
+        self._file = open(filename, "wb")
+        self._file.write(
+            TRACE_MAGIC + struct.pack("<HH", TRACE_VERSION, len(self.columns))
+        )
+        for name in self.columns:
+            encoded = name.encode()
+            self._file.write(struct.pack("<H", len(encoded)) + encoded)
+        self._file.flush()
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, rows):
+        """
+        Queue a (rows, columns) array, the caller must not modify it afterwards.
+        """
+        if len(rows):
+            self._queue.put(rows)
+
+    def close(self):
+        """
+        Write the queued chunks and close the file.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def _run(self):
+        while True:
+            rows = self._queue.get()
+            if rows is None:
+                return
+            self._file.write(struct.pack("<I", len(rows)))
+            self._file.write(np.ascontiguousarray(rows.T, dtype="<f8").tobytes())
+            self._file.flush()
+
+
+def read_trace(filename):
+    """
+    Read a trace into one array per column. A chunk cut short by a crash is
+    skipped.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    if data[:4] != TRACE_MAGIC:
+        raise ValueError(f"{filename} is not a trace file")
+    version, column_count = struct.unpack_from("<HH", data, 4)
+    if version != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version: {version}")
+    offset = 8
+    columns = []
+    for _ in range(column_count):
+        (length,) = struct.unpack_from("<H", data, offset)
+        columns.append(data[offset + 2 : offset + 2 + length].decode())
+        offset += 2 + length
+
+    chunks = []
+    while offset + 4 <= len(data):
+        (rows,) = struct.unpack_from("<I", data, offset)
+        size = rows * column_count * 8
+        if offset + 4 + size > len(data):
+            break
+        chunk = np.frombuffer(
+            data, dtype="<f8", count=rows * column_count, offset=offset + 4
+        )
+        chunks.append(chunk.reshape(column_count, rows))
+        offset += 4 + size
+
+    if chunks:
+        values = np.concatenate(chunks, axis=1)
+    else:
+        values = np.zeros((column_count, 0))
+    return {name: values[i] for i, name in enumerate(columns)}
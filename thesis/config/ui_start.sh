@@ -27,4 +27,4 @@ if [ "$EUID" -ne 0 ]; then
 fi
 
 $SUDO_CMD ip netns exec ns1 \
-    "$PYTHON_BIN" "$ROOT_DIR/thesis/live_monitor.py" --config "$1"
+    "$PYTHON_BIN" "$ROOT_DIR/thesis/live_monitor.py" --config "$1" "${@:2}"
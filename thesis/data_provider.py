@@ -3,6 +3,8 @@ import asyncio
 """
     Simulates an application providing data to the protocol.
     Pushes dummy data into the queue at [rate_mbit] mbit/s.
+    The payload is allocated once as bytes, the queue carries memoryview
+    slices of it, which the stream copies into its send buffer directly.
 """
 
 
@@ -13,15 +15,24 @@ async def provider(queue, configuration):
     single_file_mode = configuration["provider"]["single_file_mode"]
     chunk_size = rate * int(125000 / subchunks)
     counter = 0
-    payload = "Data".ljust(chunk_size, "X")
 
     if single_file_mode:
         filesize = int(configuration["provider"]["single_file_size_mbit"])
-        marker = "!"
         payload_size = filesize * 125000
-        queue.put_nowait("?".ljust(payload_size - len(marker), "X") + marker)
+        file_chunk_size = int(
+            float(configuration["provider"].get("single_file_chunk_mbit", 8)) * 125000
+        )
+        # "?" + "X" * ... + "!", without an intermediate copy
+        payload = bytearray(b"X") * payload_size
+        payload[0:1] = b"?"
+        payload[-1:] = b"!"
+        view = memoryview(payload)
+        for start in range(0, payload_size, file_chunk_size):
+            queue.put_nowait(view[start : start + file_chunk_size])
         return
 
+    # the same immutable chunk is handed out every time
+    payload = memoryview(b"Data".ljust(chunk_size, b"X"))
     while True:
         queue.put_nowait(payload)
 
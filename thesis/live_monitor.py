@@ -1,5 +1,7 @@
 import argparse
 from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 import os
 import signal
 import subprocess
@@ -11,27 +13,97 @@ try:
 except ModuleNotFoundError:
     import tomli as tomllib
 from matplotlib import pyplot as plt
-from matplotlib import animation
 from matplotlib.widgets import Button
 import numpy as np
 import zmq
 
 from AnalyzerUnit import AnalyzerUnit
+from MonitorRenderer import BlitRenderer
+import Telemetry
 
 SCREENSHOT_INDEX = 0
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--config", required=True)
+parser.add_argument(
+    "--flows",
+    choices=["aggregate", "overlay"],
+    default="aggregate",
+    help="aggregate: sum (byte metrics) or average the flows in one set of lines,"
+    " overlay: one line per flow and metric",
+)
+parser.add_argument(
+    "--headless",
+    action="store_true",
+    help="no window (Agg), periodic png/json snapshots instead, e.g. over ssh",
+)
+parser.add_argument(
+    "--snapshot-interval",
+    type=float,
+    default=5,
+    help="headless: seconds between snapshots, skipped without new samples",
+)
+parser.add_argument("--snapshot-dir", default="../data_out/monitor")
+parser.add_argument(
+    "--http-host",
+    default="127.0.0.1",
+    help="headless: address the http server binds, local only by default (ssh)",
+)
+parser.add_argument(
+    "--http-port",
+    type=int,
+    help="headless: also serve /latest.json and /latest.png on this port",
+)
 args = parser.parse_args()
+if args.headless:
+    plt.switch_backend("Agg")
 
 config = None
 with open(args.config, "rb") as f:
     config = tomllib.load(f)
     print("config read @monitor")
 
-_analyzer_unit = AnalyzerUnit(
-    config=config,
-)
+composition = config["monitor"]["composition"]
+units = config["monitor"]["units"]
+columns = ["delta_t"] + config["cca"]["transferred_metrics"]
+# flows without samples for this long are left out of the aggregate
+STALE_AFTER = 1.0
+LINESTYLES = ["-", "--", ":", "-."]
+
+
+class Flow:
+    """
+    One connection seen by the monitor, with its own analyzer.
+    """
+
+    def __init__(self, flow_id, origin, color):
+        self.id = flow_id
+        self.origin = origin
+        self.color = color
+        self.analyzer = AnalyzerUnit(config=config)
+        self.rendered_seq = None
+        # copies taken under the receiver lock by update()
+        self.metrics = None
+        self.crr = None
+        self.loss_rate = None
+        self.lines = {}
+
+    def snapshot(self):
+        self.rendered_seq = self.analyzer.seq
+        self.analyzer.update_processing()
+        self.metrics = self.analyzer.metrics
+        self.crr = np.array(self.analyzer.congwin_to_response_ratio)
+        self.loss_rate = np.array(self.analyzer.loss_rate)
+
+    def times(self):
+        """
+        Unix times of the samples in the window.
+        """
+        return self.origin + self.metrics["delta_t"]
+
+
+# flow id -> Flow, filled by the receiver thread under receiver.lock
+flows = {}
 save_log = deque()
 
 fig = plt.figure(figsize=(19.2 * 0.8, 10.8 * 0.8), dpi=100)
@@ -48,15 +120,19 @@ axes["right"] = plt.subplot2grid((4, 2), (2, 1))
 
 axes["ratio"] = plt.subplot2grid((4, 2), (3, 0), colspan=2)
 
+# aggregated lines, the per flow lines are kept by their Flow
 lines = {}
 
 
-for ax in config["monitor"]["composition"]:
-    for metric in config["monitor"]["composition"][ax]:
-        (line,) = axes[ax].plot(
-            [], [], label=f"{metric}({config['monitor']['units'][metric]})"
-        )
-        lines[(metric, ax)] = line
+for ax in composition:
+    for k, metric in enumerate(composition[ax]):
+        label = f"{metric}({units[metric]})"
+        if args.flows == "aggregate":
+            (line,) = axes[ax].plot([], [], label=label)
+            lines[(metric, ax)] = line
+        else:
+            # legend entry only, the flows are told apart by colour
+            axes[ax].plot([], [], color="gray", ls=LINESTYLES[k % 4], label=label)
 
     axes[ax].legend(loc=2)
 
@@ -64,8 +140,8 @@ axes["left"].set_ylim(0, 0.5)
 axes["out"].set_xticks([])
 axes["left"].set_xticks([])
 
-(lines[("crr", "ratio")],) = axes["ratio"].plot([], [], label="cwnd_resp_ratio")
-(lines[("loss", "right")],) = axes["right"].plot([], [], label="Loss %")
+axes["ratio"].plot([], [], color="gray", label="cwnd_resp_ratio")
+axes["right"].plot([], [], color="gray", label="Loss %")
 
 axes["ratio"].set_ylim(0, 1)
 
@@ -75,6 +151,45 @@ axes["right"].legend(loc=2)
 axes["right"].set_xticks([])
 axes["ratio"].set_xticks([])
 
+# time axes show seconds before the newest sample, the limits only change
+# when the data leaves them, every other frame is blitted
+axes["in"].set_xlabel("t - now (s)")
+renderer = BlitRenderer(fig)
+for line in lines.values():
+    renderer.add_line(line)
+# set when flows come and go, forces a frame
+layout_changed = [True]
+flow_legend = [None]
+
+
+def add_flow_lines(flow):
+    if args.flows == "overlay":
+        for ax in composition:
+            for k, metric in enumerate(composition[ax]):
+                (flow.lines[(metric, ax)],) = axes[ax].plot(
+                    [], [], color=flow.color, ls=LINESTYLES[k % 4]
+                )
+    (flow.lines[("crr", "ratio")],) = axes["ratio"].plot([], [], color=flow.color)
+    (flow.lines[("loss", "right")],) = axes["right"].plot([], [], color=flow.color)
+    for line in flow.lines.values():
+        renderer.add_line(line)
+
+
+def update_flow_legend():
+    if flow_legend[0] is not None:
+        flow_legend[0].remove()
+        flow_legend[0] = None
+    shown = [flow for flow in flows.values() if flow.lines]
+    if shown:
+        flow_legend[0] = fig.legend(
+            [flow.lines[("crr", "ratio")] for flow in shown],
+            [flow.id for flow in shown],
+            loc="lower left",
+            ncol=min(len(shown), 6),
+            fontsize="small",
+        )
+
+
 process = [None]
 
 
@@ -104,7 +219,16 @@ def handle_start_button(event):
         start_button.label.set_text("Running...\nPress to Stop")
     else:
         stop_client()
-        _analyzer_unit.input_queue.clear()
+        with receiver.lock:
+            removed = list(flows.values())
+            flows.clear()
+        for flow in removed:
+            for line in flow.lines.values():
+                renderer.remove_line(line)
+        for line in lines.values():
+            line.set_data([], [])
+        update_flow_legend()
+        layout_changed[0] = True
         start_button.label.set_text("Run")
 
 
@@ -115,76 +239,259 @@ def on_close(event):
 
 fig.canvas.mpl_connect("close_event", on_close)
 
-start_button_ax = fig.add_axes([0.8, 0.01, 0.1, 0.075])
-start_button = Button(start_button_ax, "Run")
-start_button.on_clicked(handle_start_button)
-
 
 def create_screenshot(event):
     global SCREENSHOT_INDEX
-    plt.savefig(f"../data_out/monitor_{SCREENSHOT_INDEX}", dpi=300, bbox_inches="tight")
+    renderer.savefig(
+        f"../data_out/monitor_{SCREENSHOT_INDEX}", dpi=300, bbox_inches="tight"
+    )
     print(f"Screenshot saved to data_out/monitor_{SCREENSHOT_INDEX}.png")
     SCREENSHOT_INDEX += 1
 
 
-screenshot_button_ax = fig.add_axes([0.69, 0.01, 0.1, 0.075])
-screenshot_button = Button(screenshot_button_ax, "Screenshot")
-screenshot_button.on_clicked(create_screenshot)
+if not args.headless:
+    start_button_ax = fig.add_axes([0.8, 0.01, 0.1, 0.075])
+    start_button = Button(start_button_ax, "Run")
+    start_button.on_clicked(handle_start_button)
+
+    screenshot_button_ax = fig.add_axes([0.69, 0.01, 0.1, 0.075])
+    screenshot_button = Button(screenshot_button_ax, "Screenshot")
+    screenshot_button.on_clicked(create_screenshot)
+
+    plt.get_current_fig_manager().toolbar.pack_forget()
 
-plt.get_current_fig_manager().toolbar.pack_forget()
+
+def flow_color(index):
+    # tab10 first, then the lighter half of tab20
+    return plt.get_cmap("tab20")((2 * index) % 20 + (index // 10) % 2)
 
 
 class DataReceiver:
-    def __init__(self):
+    def __init__(self, poll_timeout_ms=100):
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.PULL)
         self.socket.bind("tcp://127.0.0.1:5555")
-
-    def update_source(self):
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.poll_timeout_ms = poll_timeout_ms
+        # guards flows and their analyzers between this thread and the ui
+        self.lock = threading.Lock()
+        self.received_samples = 0
+        self.rejected = set()
+
+    def drain(self):
+        """
+        Receive every pending message without blocking, as a list of
+        (flow id, origin, rows).
+        """
+        batches = []
         while True:
             try:
-                data = self.socket.recv_json(flags=zmq.NOBLOCK)
-                _analyzer_unit.input_queue.append(data)
-                save_log.append(data)
-                time.sleep(0.1)
+                batches.append(Telemetry.decode(self.socket.recv(flags=zmq.NOBLOCK)))
             except zmq.Again:
-                time.sleep(0.1)
-
-
-def update(i):
-    _analyzer_unit.update_processing()
-    for ax in config["monitor"]["composition"]:
-        for metric in config["monitor"]["composition"][ax]:
-            lines[(metric, ax)].set_data(
-                _analyzer_unit.metrics["delta_t"], _analyzer_unit.metrics[metric]
-            )
-
-        axes[ax].relim()
-        axes[ax].autoscale_view(scalex=False, scaley=True)
-        if len(_analyzer_unit.input_queue) > 1:
-            axes[ax].set_xlim(
-                _analyzer_unit.metrics["delta_t"][0],
-                _analyzer_unit.metrics["delta_t"][-1],
-            )
-
-    crr = _analyzer_unit.congwin_to_response_ratio
-    lines["crr", "ratio"].set_data(
-        np.arange(len(crr)),
-        crr,
-    )
-    lines["loss", "right"].set_data(
-        np.arange(len(_analyzer_unit.loss_rate)),
-        np.array(_analyzer_unit.loss_rate) * 100,
-    )  # Convert to percent
-
-    axes["right"].autoscale_view()
-    axes["ratio"].autoscale_view()
+                break
+        return batches
 
-    axes["right"].relim()
-    axes["ratio"].relim()
+    def update_source(self):
+        # one thread for all flows, a flow only costs its analyzer
+        while True:
+            if not self.poller.poll(self.poll_timeout_ms):
+                continue
+            batches = self.drain()
+            with self.lock:
+                for flow_id, origin, rows in batches:
+                    if rows.shape[1] != len(columns):
+                        # a logger with other transferred_metrics, would
+                        # break the analyzer
+                        if flow_id not in self.rejected:
+                            print(f"Ignoring flow {flow_id}: columns do not match")
+                            self.rejected.add(flow_id)
+                        continue
+                    flow = flows.get(flow_id)
+                    if flow is None:
+                        flow = Flow(flow_id, origin, flow_color(len(flows)))
+                        flows[flow_id] = flow
+                        print(f"New flow: {flow_id}")
+                    for data in rows:
+                        flow.analyzer.add_to_queue(data)
+            for flow_id, _, rows in batches:
+                save_log.append((flow_id, rows))
+                self.received_samples += len(rows)
+
+
+def draw_aggregate(shown, now):
+    active = [flow for flow in shown if now - flow.times()[-1] <= STALE_AFTER]
+    # the samples of the newest flow are the grid the others are resampled to
+    reference = max(active, key=lambda flow: flow.times()[-1])
+    grid = reference.times()
+    for ax in composition:
+        for metric in composition[ax]:
+            if len(active) == 1:
+                values = reference.metrics[metric]
+            else:
+                series = np.array(
+                    [
+                        np.interp(grid, flow.times(), flow.metrics[metric], left=np.nan)
+                        for flow in active
+                    ]
+                )
+                if units[metric] == "byte":
+                    values = np.nansum(series, axis=0)
+                else:
+                    values = np.nanmean(series, axis=0)
+            renderer.set_data(lines[(metric, ax)], grid - now, values)
+
+
+def draw_overlay(shown, now):
+    for flow in shown:
+        t = flow.times() - now
+        for ax in composition:
+            for metric in composition[ax]:
+                renderer.set_data(flow.lines[(metric, ax)], t, flow.metrics[metric])
+
+
+def refresh():
+    """
+    Move new samples into the lines, False when nothing changed.
+    """
+    with receiver.lock:
+        current = list(flows.values())
+        changed = [flow for flow in current if flow.analyzer.seq != flow.rendered_seq]
+        if not changed and not layout_changed[0]:
+            return False
+        for flow in changed:
+            flow.snapshot()
+    layout_changed[0] = False
+
+    new = [flow for flow in current if not flow.lines]
+    for flow in new:
+        add_flow_lines(flow)
+    if new:
+        update_flow_legend()
+
+    shown = [
+        flow
+        for flow in current
+        if flow.metrics is not None and len(flow.metrics["delta_t"])
+    ]
+    if shown:
+        now = max(flow.times()[-1] for flow in shown)
+        if args.flows == "aggregate":
+            draw_aggregate(shown, now)
+        else:
+            draw_overlay(shown, now)
+    for flow in shown:
+        crr = flow.crr
+        renderer.set_data(flow.lines["crr", "ratio"], np.arange(len(crr)), crr)
+        renderer.set_data(
+            flow.lines["loss", "right"],
+            np.arange(len(flow.loss_rate)),
+            flow.loss_rate * 100,
+        )  # Convert to percent
+    return True
+
+
+def update():
+    if refresh():
+        renderer.render()
+
+
+def summary():
+    """
+    Latest values of every flow and their aggregate, as shown in the plots.
+    """
+    with receiver.lock:
+        shown = [
+            flow
+            for flow in flows.values()
+            if flow.metrics is not None and len(flow.metrics["delta_t"])
+        ]
+    result = {"time": time.time(), "flows": {}, "aggregate": {}}
+    if not shown:
+        return result
+    now = max(flow.times()[-1] for flow in shown)
+    metrics = config["cca"]["transferred_metrics"]
+    for flow in shown:
+        result["flows"][flow.id] = {
+            "samples": flow.rendered_seq,
+            "age_s": now - flow.times()[-1],
+            "latest": {metric: float(flow.metrics[metric][-1]) for metric in metrics},
+            "cwnd_resp_ratio": float(flow.crr[-1]),
+            "loss_percent": float(flow.loss_rate[-1] * 100),
+        }
+    active = [flow for flow in shown if now - flow.times()[-1] <= STALE_AFTER]
+    for metric in metrics:
+        values = [flow.metrics[metric][-1] for flow in active]
+        if units.get(metric) == "byte":
+            result["aggregate"][metric] = float(np.sum(values))
+        else:
+            result["aggregate"][metric] = float(np.mean(values))
+    result["aggregate"]["flows"] = len(active)
+    return result
+
+
+# latest snapshot, served by the http endpoint
+latest = {"json": b"{}", "png": b""}
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path in ("/", "/latest.json"):
+            body, content_type = latest["json"], "application/json"
+        elif self.path == "/latest.png":
+            body, content_type = latest["png"], "image/png"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_snapshot():
+    # written next to the final name and renamed, readers never see half a file
+    os.makedirs(args.snapshot_dir, exist_ok=True)
+    png = os.path.join(args.snapshot_dir, "latest.png")
+    # headless mode never calls render(), which fits the limits otherwise
+    renderer.rescale()
+    renderer.savefig(png + ".tmp", format="png")
+    os.replace(png + ".tmp", png)
+    encoded = json.dumps(summary(), indent=1).encode()
+    json_file = os.path.join(args.snapshot_dir, "latest.json")
+    with open(json_file + ".tmp", "wb") as f:
+        f.write(encoded)
+    os.replace(json_file + ".tmp", json_file)
+    with open(png, "rb") as f:
+        latest["png"] = f.read()
+    latest["json"] = encoded
+
+
+def run_headless():
+    if args.http_port is not None:
+        server = ThreadingHTTPServer((args.http_host, args.http_port), SnapshotHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving snapshots on {args.http_host}:{args.http_port}")
+    print(f"Snapshots every {args.snapshot_interval}s to {args.snapshot_dir}")
+    try:
+        while True:
+            if refresh():
+                write_snapshot()
+            time.sleep(args.snapshot_interval)
+    except KeyboardInterrupt:
+        pass
 
 
 receiver = DataReceiver()
 threading.Thread(target=receiver.update_source, daemon=True).start()
-ani = animation.FuncAnimation(fig, update, interval=32, cache_frame_data=False)
-plt.show()
+if args.headless:
+    run_headless()
+else:
+    timer = fig.canvas.new_timer(interval=32)
+    timer.add_callback(update)
+    timer.start()
+    plt.show()
@@ -0,0 +1,476 @@
+import argparse
+import asyncio
+import collections
+import heapq
+import math
+import random
+import re
+import statistics
+import time
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import tomli as tomllib
+import TickScheduler
+from aioquic.quic.packet import QuicPacketType
+from aioquic.quic.packet_builder import QuicDeliveryState, QuicSentPacket
+from aioquic.quic.rangeset import RangeSet
+from aioquic.quic.recovery import QuicPacketRecovery, QuicPacketSpace
+from aioquic.tls import Epoch
+
+"""
+    Deterministic discrete-event simulation of a netem bottleneck.
+    Runs QuicPacketRecovery and the registered congestion controls on an
+    asyncio loop whose clock is virtual, so periodic controller ticks and
+    logger samples advance with simulated instead of wall-clock time.
+    Link arguments mirror config/network_setup.sh.
+"""
+
+ACK_SIZE = 50
+K_MIN_PACKET_SIZE = 64
+K_TIMER_RESOLUTION = 0.000001
+K_MAX_ACK_RANGES = 16
+
+
+class _VirtualSelector:
+    """
+    Stands in for the I/O selector: instead of polling sockets it delivers
+    the simulated network events due before the loop's next timer.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+
+    def select(self, timeout=None):
+        loop = self._loop
+        events = loop._events
+        deadline = math.inf if timeout is None else loop._now + timeout
+        if not events and deadline == math.inf:
+            raise RuntimeError("Simulation has no pending events")
+
+        while events and events[0][0] <= deadline:
+            when, _, callback, args = heapq.heappop(events)
+            loop._now = max(loop._now, when)
+            callback(*args)
+            if loop._ready:
+                return []
+            if loop._scheduled:
+                deadline = min(deadline, loop._scheduled[0]._when)
+
+        loop._now = max(loop._now, deadline)
+        return []
+
+    def close(self):
+        pass
+
+
+class VirtualClockLoop(asyncio.BaseEventLoop):
+    def __init__(self, start=0.0):
+        super().__init__()
+        self._now = start
+        self._events = []
+        self._event_seq = 0
+        self._selector = _VirtualSelector(self)
+
+    def time(self):
+        return self._now
+
+    def call_event(self, when, callback, *args):
+        """
+        Schedule a non-cancellable network event, cheaper than `call_at`.
+        """
+        self._event_seq += 1
+        heapq.heappush(self._events, (when, self._event_seq, callback, args))
+
+    def _process_events(self, event_list):
+        pass
+
+    def _write_to_self(self):
+        pass
+
+
+def parse_time(value):
+    match = re.fullmatch(r"([\d.]+)\s*(us|ms|s)?", str(value))
+    if match is None:
+        raise ValueError(f"invalid time: {value}")
+    scale = {"us": 1e-6, "ms": 1e-3, "s": 1, None: 1}[match.group(2)]
+    return float(match.group(1)) * scale
+
+
+def parse_rate(value):
+    match = re.fullmatch(r"([\d.]+)\s*(bit|kbit|mbit|gbit)?", str(value).lower())
+    if match is None:
+        raise ValueError(f"invalid rate: {value}")
+    scale = {"bit": 1, "kbit": 1e3, "mbit": 1e6, "gbit": 1e9, None: 1}
+    return float(match.group(1)) * scale[match.group(2)]
+
+
+def parse_loss(value):
+    return float(str(value).rstrip("%")) / 100
+
+
+class NetemLink:
+    """
+    One direction of a netem qdisc: random loss on enqueue, a rate limited
+    serializer and a delay line with uniform jitter. Like netem, `limit`
+    counts every packet held by the qdisc, including the delay line.
+    """
+
+    def __init__(self, loop, rng, *, rate, delay, jitter, loss, limit):
+        self._loop = loop
+        self._rng = rng
+        self.rate = rate
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.limit = limit
+
+        self._busy_until = 0.0
+        self._held = []
+        self.dropped = 0
+        self.lost = 0
+
+    def send(self, size, callback, *args):
+        now = self._loop.time()
+        held = self._held
+        while held and held[0] <= now:
+            heapq.heappop(held)
+        if len(held) >= self.limit:
+            self.dropped += 1
+            return
+        if self.loss and self._rng.random() < self.loss:
+            self.lost += 1
+            return
+
+        self._busy_until = max(now, self._busy_until) + size * 8 / self.rate
+        exit_time = self._busy_until + self.delay
+        if self.jitter:
+            exit_time += self._rng.uniform(-self.jitter, self.jitter)
+            exit_time = max(exit_time, self._busy_until)
+        heapq.heappush(held, exit_time)
+        self._loop.call_event(exit_time, callback, *args)
+
+
+class NetworkSimulator:
+    def __init__(
+        self,
+        external_config,
+        *,
+        rate,
+        rtt,
+        jitter=0.0,
+        loss=0.0,
+        limit=1000,
+        ack_limit=1000,
+        duration=600.0,
+        transfer_bytes=None,
+        max_datagram_size=1200,
+        ack_every=2,
+        max_ack_delay=0.025,
+        seed=0,
+    ):
+        self.external_config = external_config
+        self.duration = duration
+        self.transfer_bytes = transfer_bytes
+        self.max_datagram_size = max_datagram_size
+        self.ack_every = ack_every
+        self.max_ack_delay = max_ack_delay
+
+        self.loop = VirtualClockLoop()
+        rng = random.Random(seed)
+        self.forward = NetemLink(
+            self.loop,
+            rng,
+            rate=rate,
+            delay=rtt / 2,
+            jitter=jitter,
+            loss=loss,
+            limit=limit,
+        )
+        self.reverse = NetemLink(
+            self.loop,
+            rng,
+            rate=rate,
+            delay=rtt / 2,
+            jitter=jitter,
+            loss=loss,
+            limit=ack_limit,
+        )
+
+        # sender
+        self._packet_number = 0
+        self._next_offset = 0
+        self._retransmit = []
+        self._send_timer = None
+        self._controller_tick = None
+        self._loss_timer = None
+        self._loss_at = None
+        self._probe_pending = False
+        self.sent_packets = 0
+        self.lost_packets = 0
+        self.rtt_samples = []
+
+        # receiver
+        self._received = RangeSet()
+        # stream offsets delivered, retransmissions may be split differently
+        self._delivered = RangeSet()
+        self._unacked = 0
+        self._ack_timer = None
+        self._first_unacked_time = None
+        self.received_bytes = 0
+        self.delivered_bytes = 0
+        self.delivered_per_second = collections.Counter()
+
+        self._done = None
+
+    async def _run(self):
+        self.space = QuicPacketSpace()
+        self.recovery = QuicPacketRecovery(
+            congestion_control_algorithm=self.external_config["cca"]["name"],
+            initial_rtt=float(self.external_config["cca"].get("initial_rtt", 0.1)),
+            max_datagram_size=self.max_datagram_size,
+            peer_completed_address_validation=True,
+            send_probe=self._send_probe,
+            external_config=self.external_config,
+        )
+        self.recovery.spaces = [self.space]
+
+        self._done = self.loop.create_future()
+        self.loop.call_at(self.duration, self._finish)
+        sampling_rate = self.external_config["cca"].get("sampling_rate")
+        if sampling_rate is not None:
+            # controllers move the window on their ticks, without an ACK or a
+            # timer in sight a blocked sender would otherwise never notice;
+            # registered after them, so the window is already updated
+            self._controller_tick = TickScheduler.get_scheduler().register(
+                1 / float(sampling_rate), self._try_send
+            )
+        self._try_send()
+        await self._done
+        if self._controller_tick is not None:
+            self._controller_tick.cancel()
+        self.recovery.close()
+
+    def run(self):
+        start = time.perf_counter()
+        self.loop.run_until_complete(self._run())
+        elapsed = time.perf_counter() - start
+        self.loop.close()
+        return self.summary(elapsed)
+
+    def summary(self, elapsed):
+        duration = self.loop.time()
+        # first second delivering 90 % of the bottleneck rate
+        converged = [
+            second
+            for second, delivered in self.delivered_per_second.items()
+            if delivered * 8 >= 0.9 * self.forward.rate
+        ]
+        return {
+            "goodput_mbit/s": self.delivered_bytes * 8 / duration / 1e6,
+            "throughput_mbit/s": self.received_bytes * 8 / duration / 1e6,
+            "loss_ratio_percent": 100 * self.lost_packets / max(self.sent_packets, 1),
+            "rtt_avg_ms": 1000 * statistics.fmean(self.rtt_samples or [0]),
+            "rtt_median_ms": 1000 * statistics.median(self.rtt_samples or [0]),
+            "convergence_s": min(converged, default=duration),
+            "simulated_s": duration,
+            "wall_clock_s": elapsed,
+        }
+
+    def _finish(self):
+        if not self._done.done():
+            self._done.set_result(None)
+
+    # sender
+
+    def _send_probe(self):
+        self._probe_pending = True
+        self.loop.call_soon(self._try_send)
+
+    def _next_size(self):
+        # like QuicPacketBuilder, shrink the packet to the flight space left
+        if self._retransmit:
+            return self._retransmit[-1][1]
+        size = self.max_datagram_size
+        if self.transfer_bytes is not None:
+            size = min(size, self.transfer_bytes - self._next_offset)
+        return size
+
+    def _try_send(self):
+        if self._send_timer is not None:
+            self._send_timer.cancel()
+            self._send_timer = None
+        if self._done.done():
+            return
+
+        recovery = self.recovery
+        pacer = recovery._pacer
+        while True:
+            size = self._next_size()
+            if size <= 0:
+                break
+            now = self.loop.time()
+            if not self._probe_pending:
+                space = recovery.congestion_window - recovery.bytes_in_flight
+                if space < K_MIN_PACKET_SIZE:
+                    break
+                pacing_at = pacer.next_send_time(now=now)
+                if pacing_at is not None:
+                    self._send_timer = self.loop.call_at(pacing_at, self._try_send)
+                    break
+                size = min(size, space)
+            self._probe_pending = False
+            self._send_packet(now, size)
+            pacer.update_after_send(now=now)
+
+        self._set_loss_timer()
+
+    def _send_packet(self, now, size):
+        if self._retransmit:
+            chunk = self._retransmit.pop()
+            if size < chunk[1]:
+                # split to the flight space, like new data
+                self._retransmit.append((chunk[0] + size, chunk[1] - size))
+                chunk = (chunk[0], size)
+        else:
+            chunk = (self._next_offset, size)
+            self._next_offset += size
+
+        packet = QuicSentPacket(
+            epoch=Epoch.ONE_RTT,
+            in_flight=True,
+            is_ack_eliciting=True,
+            is_crypto_packet=False,
+            packet_number=self._packet_number,
+            packet_type=QuicPacketType.ONE_RTT,
+            sent_time=now,
+            sent_bytes=chunk[1],
+        )
+        packet.delivery_handlers.append((self._on_packet_delivery, (chunk,)))
+        self._packet_number += 1
+        self.sent_packets += 1
+        self.recovery.on_packet_sent(packet=packet, space=self.space)
+        self.forward.send(
+            chunk[1], self._on_packet_received, packet.packet_number, chunk
+        )
+
+    def _on_packet_delivery(self, delivery_state, chunk):
+        if delivery_state == QuicDeliveryState.LOST:
+            self.lost_packets += 1
+            self._retransmit.append(chunk)
+
+    def _set_loss_timer(self):
+        loss_at = self.recovery.get_loss_detection_time()
+        if loss_at == self._loss_at:
+            return
+        if self._loss_timer is not None:
+            self._loss_timer.cancel()
+            self._loss_timer = None
+        self._loss_at = loss_at
+        if loss_at is not None:
+            # a real clock always moves on, never re-fire at the same instant
+            self._loss_timer = self.loop.call_at(
+                max(loss_at, self.loop.time() + K_TIMER_RESOLUTION),
+                self._on_loss_timeout,
+            )
+
+    def _on_loss_timeout(self):
+        self._loss_timer = None
+        self._loss_at = None
+        self.recovery.on_loss_detection_timeout(now=self.loop.time())
+        self._try_send()
+
+    def _on_ack_received(self, ack_rangeset, ack_delay):
+        now = self.loop.time()
+        self.recovery.on_ack_received(
+            ack_rangeset=ack_rangeset, ack_delay=ack_delay, now=now, space=self.space
+        )
+        self.rtt_samples.append(self.recovery._rtt_latest)
+        self._try_send()
+
+    # receiver
+
+    def _on_packet_received(self, packet_number, chunk):
+        now = self.loop.time()
+        self.received_bytes += chunk[1]
+        delivered = self._new_bytes(chunk[0], chunk[0] + chunk[1])
+        if delivered:
+            self.delivered_bytes += delivered
+            self.delivered_per_second[int(now)] += delivered
+            if (
+                self.transfer_bytes is not None
+                and self.delivered_bytes >= self.transfer_bytes
+            ):
+                self._finish()
+
+        self._received.add(packet_number)
+        while len(self._received) > K_MAX_ACK_RANGES:
+            self._received.shift()
+
+        if self._first_unacked_time is None:
+            self._first_unacked_time = now
+        self._unacked += 1
+        if self._unacked >= self.ack_every:
+            self._send_ack()
+        elif self._ack_timer is None:
+            self._ack_timer = self.loop.call_later(self.max_ack_delay, self._send_ack)
+
+    def _new_bytes(self, start, stop):
+        covered = 0
+        for r in self._delivered:
+            covered += max(0, min(stop, r.stop) - max(start, r.start))
+        self._delivered.add(start, stop)
+        return stop - start - covered
+
+    def _send_ack(self):
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        ack_delay = self.loop.time() - self._first_unacked_time
+        self._unacked = 0
+        self._first_unacked_time = None
+        self.reverse.send(
+            ACK_SIZE, self._on_ack_received, RangeSet(self._received), ack_delay
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--rtt", default="100ms")
+    parser.add_argument("--jitter", default="0ms")
+    parser.add_argument("--loss", default="0%")
+    parser.add_argument("--rate", default="10mbit")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--ack-limit", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    config["out"]["ui_out"] = False
+
+    transfer_bytes = None
+    if config["provider"]["single_file_mode"]:
+        transfer_bytes = int(config["provider"]["single_file_size_mbit"]) * 125000
+
+    simulator = NetworkSimulator(
+        config,
+        rate=parse_rate(args.rate),
+        rtt=parse_time(args.rtt),
+        jitter=parse_time(args.jitter),
+        loss=parse_loss(args.loss),
+        limit=args.limit,
+        ack_limit=args.ack_limit,
+        duration=args.duration,
+        transfer_bytes=transfer_bytes,
+        seed=args.seed,
+    )
+    for key, value in simulator.run().items():
+        print(f"{key}: {value:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import argparse
+import csv
+import importlib
+import itertools
+import time
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import tomli as tomllib
+import numpy as np
+from aioquic.quic.congestion.pulse import K_MIN_PROBE_DATAGRAMS
+from aioquic.quic.congestion.waveform import create_waveform
+from TraceWriter import read_trace
+
+"""
+    Offline replay of the PULSE state machine over recorded *_raw.csv or
+    *_raw.trace traces.
+    Every parameter combination is one row of a parameter axis, all of them
+    are stepped through the trace at once with NumPy broadcasting.
+
+    The replay is open loop: the recorded ACK response is reused for every
+    configuration and capped by that configuration's own congestion window.
+    The delivery rate of a sampling interval stands in for the per-ACK rate
+    samples of the delivery_rate BDP estimator. Controller options the
+    replay does not model are rejected, see check_config.
+"""
+
+STARTUP, INCREASE, CORRECT, STATIC, SENSE = range(5)
+STATE_NAMES = ["STARTUP", "INCREASE", "CORRECT", "STATIC", "SENSE"]
+
+# controller options the replay does not model, with the value turning them off
+UNMODELLED_OPTIONS = {
+    "response_analysis": "peak",
+    "shallow_buffer_mitigation": False,
+    "adaptive_amplitude": False,
+    "loss_reaction": False,
+}
+BDP_ESTIMATORS = ["delivery_rate", "acked_byte"]
+
+
+def load_trace(filename):
+    if filename.endswith(".trace"):
+        return read_trace(filename)
+    with open(filename, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        data = np.array([[float(v) for v in row] for row in reader], dtype=float)
+    return {name: data[:, i] for i, name in enumerate(header)}
+
+
+def parameter_grid(phi, increase_percentile, base_to_amplitude_ratio, waveform):
+    combinations = list(
+        itertools.product(phi, increase_percentile, base_to_amplitude_ratio, waveform)
+    )
+    return {
+        "phi": np.array([c[0] for c in combinations], dtype=float),
+        "increase_percentile": np.array([c[1] for c in combinations], dtype=float),
+        "base_to_amplitude_ratio": np.array([c[2] for c in combinations], dtype=float),
+        "waveform": np.array([waveform.index(c[3]) for c in combinations]),
+        "waveform_names": list(waveform),
+    }
+
+
+def periodic_component(waveforms, waveform, delta_t):
+    # one table lookup per waveform, then selected per configuration
+    values = []
+    for w in waveforms:
+        phase = (w.frequency * delta_t) % 1
+        values.append(w.table[int(phase * len(w.table)) % len(w.table)])
+    return np.choose(waveform, values)
+
+
+def row_percentile(values, q):
+    # np.percentile (linear) with one percentile per row
+    ordered = np.sort(values, axis=1)
+    position = q / 100 * (ordered.shape[1] - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, ordered.shape[1] - 1)
+    rows = np.arange(ordered.shape[0])
+    fraction = position - lower
+    return ordered[rows, lower] * (1 - fraction) + ordered[rows, upper] * fraction
+
+
+def check_config(cca):
+    """
+    Raise ValueError if the config selects behaviour the replay does not
+    model, return the BDP estimator of CORRECT.
+    """
+    unmodelled = [
+        f"{key} = {cca[key]!r}"
+        for key, value in UNMODELLED_OPTIONS.items()
+        if cca.get(key, value) != value
+    ]
+    if unmodelled:
+        raise ValueError(f"Replay does not model {', '.join(unmodelled)}")
+    estimator = cca.get("bdp_estimator", "delivery_rate")
+    if estimator not in BDP_ESTIMATORS:
+        raise ValueError(f"Unknown bdp_estimator: {estimator}")
+    return estimator
+
+
+def replay(trace, params, config):
+    cca = config["cca"]
+    bdp_estimator = check_config(cca)
+    frequency = float(cca["mod_rate"])
+    sampling_interval = 1 / float(cca["sampling_rate"])
+    window = int(float(cca["sampling_rate"]) / frequency * 2)
+    initial_rtt = float(cca["initial_rtt"])
+    # the client's QuicConfiguration, not part of the trace
+    max_datagram_size = int(cca.get("max_datagram_size", 1200))
+    bandwidth_window = float(cca.get("bandwidth_window", window * sampling_interval))
+
+    phi = params["phi"]
+    percentile = params["increase_percentile"]
+    alpha = params["base_to_amplitude_ratio"]
+    waveform = params["waveform"]
+    waveforms = [
+        create_waveform(name, frequency=frequency, config=cca)
+        for name in params["waveform_names"]
+    ]
+    n = len(phi)
+
+    delta_t = trace["delta_t"]
+    acked_raw = trace["acked_byte"]
+    rtt = trace["rtt"]
+    steps = len(delta_t)
+
+    base = np.full(n, float(cca["cwnd_base_0"]))
+    rtt_estimate = np.full(n, initial_rtt)
+    # the logger reports initial_rtt until the first RTT sample
+    measured_rtt = np.flatnonzero(rtt != initial_rtt)
+    first_rtt_time = delta_t[measured_rtt[0]] if len(measured_rtt) else np.inf
+    state = np.full(n, STARTUP)
+    state_start = np.full(n, delta_t[0])
+
+    # analyzer windows, one row per configuration
+    cwnd_window = np.zeros((n, window))
+    acked_window = np.zeros((n, window))
+    base_latest = np.ones(n)
+    rtt_window = np.zeros(window)
+    crr = np.zeros((n, window))
+    # one delivery rate sample per interval stands in for the per-ACK ones
+    rate_slots = int(np.ceil(bandwidth_window / sampling_interval)) + 1
+    rate_window = np.zeros((n, rate_slots))
+    rate_time = np.full(rate_slots, -np.inf)
+
+    states = np.empty((steps, n), dtype=np.int8)
+    bases = np.empty((steps, n))
+    delivered = np.zeros(n)
+    transitions = np.zeros(n, dtype=int)
+    first_correct = np.full(n, np.nan)
+
+    max_frequency = np.array([w.max_frequency for w in waveforms])[waveform]
+    growth = 1 + 2 * np.pi * alpha * max_frequency * phi
+
+    for k in range(steps):
+        now = delta_t[k]
+        slot = k % window
+        count = min(k + 1, window)
+
+        # modulation and logger sample
+        cwnd = np.floor(
+            base + base * alpha * periodic_component(waveforms, waveform, now)
+        )
+        # the path cannot deliver more than one window per round trip
+        acked_capped = np.minimum(acked_raw[k], cwnd * sampling_interval / rtt[k])
+        acked = acked_capped * rtt_estimate / sampling_interval
+        delivered += acked_capped
+        rate_window[:, k % rate_slots] = acked_capped / sampling_interval
+        rate_time[k % rate_slots] = now
+
+        cwnd_window[:, slot] = cwnd
+        acked_window[:, slot] = acked
+        base_latest = base
+        rtt_window[slot] = rtt[k]
+
+        # analyzer
+        cwnd_max = cwnd_window[:, :count].max(axis=1)
+        acked_max = acked_window[:, :count].max(axis=1)
+        rtt_min = rtt_window[:count].min()
+        ratio = np.where(
+            acked_max == 0, 0.5, (cwnd_max - acked_max) / (2 * base_latest * alpha)
+        )
+        crr[:, k % window] = ratio
+
+        # controller, every configuration only evaluates its own state
+        active = now - state_start
+        next_state = state.copy()
+
+        # the window must only hold measured RTTs, not initial_rtt
+        measured = now - first_rtt_time > window * sampling_interval
+        startup = (
+            (state == STARTUP) & (active > window * sampling_interval * 2) & measured
+        )
+        rtt_estimate = np.where(startup, rtt_min, rtt_estimate)
+        next_state[startup] = INCREASE
+
+        increase = state == INCREASE
+        base = np.where(increase, base * growth, base)
+        resolvable = base * alpha >= K_MIN_PROBE_DATAGRAMS * max_datagram_size
+        saturated = increase & (row_percentile(crr, percentile) > 0.5) & resolvable
+        next_state[saturated] = CORRECT
+
+        static = state == STATIC
+        mean = crr.mean(axis=1)
+        next_state[static & ((mean < 0.4) | (mean > 0.5))] = CORRECT
+
+        correct = state == CORRECT
+        estimate = acked_max
+        if bdp_estimator == "delivery_rate":
+            recent = rate_time > now - bandwidth_window
+            estimate = rate_window[:, recent].max(axis=1) * rtt_estimate
+            # an unsaturated path only delivers what the window allows, the
+            # rate samples are a lower bound there
+            estimate = np.where(mean < 0.4, np.maximum(estimate, acked_max), estimate)
+        base = np.where(correct, estimate, base)
+        next_state[correct] = SENSE
+        first_correct = np.where(correct & np.isnan(first_correct), now, first_correct)
+
+        sense = state == SENSE
+        rtt_estimate = np.where(sense, rtt_min, rtt_estimate)
+        next_state[sense & (active > window * sampling_interval)] = STATIC
+
+        changed = next_state != state
+        state_start = np.where(changed, now, state_start)
+        transitions += changed
+        state = next_state
+
+        states[k] = state
+        bases[k] = base
+
+    return {
+        "states": states,
+        "bases": bases,
+        "delivered": delivered,
+        "transitions": transitions,
+        "first_correct": first_correct,
+        "duration": delta_t[-1] - delta_t[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", required=True)
+    parser.add_argument("--phi", type=float, nargs="+")
+    parser.add_argument("--increase-percentile", type=float, nargs="+")
+    parser.add_argument("--amplitude", type=float, nargs="+")
+    parser.add_argument("--waveform", nargs="+")
+    parser.add_argument("--top", type=int, default=10)
+    # an option, a positional list would be swallowed by the lists above
+    parser.add_argument(
+        "--trace",
+        dest="traces",
+        action="append",
+        required=True,
+        help="csv or binary logger trace, repeat for several traces",
+    )
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+
+    cca = config["cca"]
+    try:
+        check_config(cca)
+    except ValueError as exc:
+        parser.error(str(exc))
+    for module in cca.get("waveform_plugins", []):
+        importlib.import_module(module)
+    params = parameter_grid(
+        args.phi or [cca["phi"]],
+        args.increase_percentile or [cca["increase_percentile"]],
+        args.amplitude or [cca["base_to_amplitude_ratio"]],
+        args.waveform or [cca["waveform"]],
+    )
+    n = len(params["phi"])
+
+    goodput = np.zeros(n)
+    transitions = np.zeros(n)
+    start = time.perf_counter()
+    for filename in args.traces:
+        result = replay(load_trace(filename), params, config)
+        goodput += result["delivered"] * 8 / result["duration"] / 1e6
+        transitions += result["transitions"]
+    elapsed = time.perf_counter() - start
+    goodput /= len(args.traces)
+    transitions /= len(args.traces)
+
+    print(
+        f"replayed {n} configurations over {len(args.traces)} traces in {elapsed:.2f}s"
+    )
+    print(
+        "phi,increase_percentile,base_to_amplitude_ratio,waveform,goodput,transitions"
+    )
+    for i in np.argsort(-goodput)[: args.top]:
+        print(
+            params["phi"][i],
+            params["increase_percentile"][i],
+            params["base_to_amplitude_ratio"][i],
+            params["waveform_names"][params["waveform"][i]],
+            round(goodput[i], 3),
+            transitions[i],
+            sep=",",
+        )
+
+
+if __name__ == "__main__":
+    main()
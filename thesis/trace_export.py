@@ -0,0 +1,38 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+from TraceWriter import read_trace
+
+"""
+    Export binary logger traces (log_writer = "trace") to csv, in the
+    layout of the *_raw.csv / *_scaled.csv dumps.
+"""
+
+
+def export(filename, output):
+    trace = read_trace(filename)
+    with open(output, mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(trace))
+        writer.writerows(np.column_stack(list(trace.values())).tolist())
+    return len(next(iter(trace.values()), []))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("traces", nargs="+")
+    parser.add_argument("--output-dir", help="defaults to the directory of every trace")
+    args = parser.parse_args()
+
+    for filename in args.traces:
+        output = filename.removesuffix(".trace") + ".csv"
+        if args.output_dir:
+            output = os.path.join(args.output_dir, os.path.basename(output))
+        rows = export(filename, output)
+        print(f"{filename}: {rows} rows written to {output}")
+
+
+if __name__ == "__main__":
+    main()